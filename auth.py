@@ -1,60 +1,189 @@
 """
 Sistema de autenticación para Money Manager G5
 """
-from datetime import datetime, timedelta
-from typing import Optional, Union
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple, Union
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import Usuario
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+from database import SessionLocal, AsyncSessionLocal, enrutador_lecturas
+from models import Usuario, RefreshToken
+from ml_cache import CacheLRU
+from hashing import password_hasher, PoolSaturated
+import hashlib
+import hmac
 import os
+import secrets
+import threading
+import time
+import uuid
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración de seguridad
 SECRET_KEY = os.getenv("SECRET_KEY", "development-secret-key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# Caché de usuarios autenticados (evita consultar la base de datos en cada petición)
+AUTH_USER_CACHE_MAX_ITEMS = int(os.getenv("AUTH_USER_CACHE_MAX_ITEMS", "10000"))
+AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60"))
 
-# Configuración de hashing de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Escritura diferida de last_login
+LAST_LOGIN_FLUSH_SECONDS = float(os.getenv("LAST_LOGIN_FLUSH_SECONDS", "30"))
+LAST_LOGIN_MAX_PENDING = int(os.getenv("LAST_LOGIN_MAX_PENDING", "500"))
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_db():
-    """Dependencia para obtener sesión de base de datos"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+class RevocationList:
+    """
+    Tokens invalidados antes de expirar, en memoria del proceso:
+    por `jti` (cierre de sesión) o por usuario, para todos los tokens emitidos
+    antes de cierto momento (desactivación de la cuenta)
+    """
+    
+    def __init__(self):
+        self._tokens: Dict[str, float] = {}  # jti -> expiración
+        self._users: Dict[int, float] = {}  # user_id -> tokens válidos solo si iat es posterior
+        self._lock = threading.Lock()
+    
+    def revoke_jti(self, jti: str, expires_at: float):
+        ahora = time.time()
+        with self._lock:
+            # Los tokens ya expirados no hace falta recordarlos
+            for vencido in [j for j, exp in self._tokens.items() if exp < ahora]:
+                del self._tokens[vencido]
+            self._tokens[jti] = expires_at
+    
+    def revoke_user(self, user_id: int):
+        with self._lock:
+            self._users[user_id] = time.time()
+    
+    def is_revoked(self, payload: dict) -> bool:
+        if payload.get("jti") in self._tokens:
+            return True
+        desde = self._users.get(payload.get("uid"))
+        return desde is not None and payload.get("iat", 0) <= desde
+
+class LastLoginBuffer:
+    """
+    Acumula en memoria el último login de cada usuario y lo escribe en un único
+    UPDATE por lotes cada LAST_LOGIN_FLUSH_SECONDS, al llegar a LAST_LOGIN_MAX_PENDING
+    usuarios pendientes o al apagar el servidor. last_login es informativo: si el
+    proceso muere sin apagarse se pierden como mucho los logins del último intervalo.
+    """
+    
+    def __init__(self, interval: float = LAST_LOGIN_FLUSH_SECONDS, max_pending: int = LAST_LOGIN_MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.written = 0
+    
+    def record(self, user_id: int, when: datetime):
+        with self._lock:
+            self._pending[user_id] = when
+            full = len(self._pending) >= self.max_pending
+        if full:
+            # Escribir ya, pero desde el hilo de escritura, no en la petición
+            self._wake.set()
+    
+    def flush(self) -> int:
+        """Escribir los logins pendientes; devuelve cuántos usuarios se actualizaron"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        db = SessionLocal()
+        try:
+            # UPDATE por clave primaria con varios parámetros: una sola sentencia ejecutada en lote
+            db.execute(update(Usuario), [{"id": user_id, "last_login": when} for user_id, when in pending.items()])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error guardando last_login de {len(pending)} usuarios: {str(e)}")
+            # Devolver al buffer lo que no se escribió, sin pisar logins más recientes
+            with self._lock:
+                for user_id, when in pending.items():
+                    self._pending.setdefault(user_id, when)
+            return 0
+        finally:
+            db.close()
+        self.flushes += 1
+        self.written += len(pending)
+        return len(pending)
+    
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+    
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="last-login", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        """Detener el hilo y escribir lo que quede pendiente"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+    
+    def metrics(self) -> Dict[str, int]:
+        return {"pendientes": len(self._pending), "escrituras": self.flushes, "usuarios_escritos": self.written}
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verificar contraseña plana contra hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+revocation_list = RevocationList()
+last_login_buffer = LastLoginBuffer()
+user_cache = CacheLRU(max_items=AUTH_USER_CACHE_MAX_ITEMS, ttl=AUTH_USER_CACHE_TTL_SECONDS)
 
-def get_password_hash(password: str) -> str:
-    """Generar hash de contraseña"""
-    return pwd_context.hash(password)
+def _pool_saturated_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Servidor ocupado, intente de nuevo en unos segundos",
+        headers={"Retry-After": "1"},
+    )
 
-def authenticate_user(db: Session, email: str, password: str) -> Union[Usuario, bool]:
-    """Autenticar usuario con email y contraseña"""
-    user = db.query(Usuario).filter(Usuario.email == email).first()
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Union[Usuario, bool]:
+    """Autenticar usuario con email y contraseña (bcrypt se ejecuta en el pool de procesos)"""
+    user = await db.scalar(select(Usuario).where(Usuario.email == email))
     if not user:
         return False
     if not user.is_active:
         return False
-    if not verify_password(password, user.password_hash):
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(password, user.password_hash)
+    except PoolSaturated:
+        raise _pool_saturated_exception()
+    if not valid:
         return False
     
-    # Actualizar último login
-    user.last_login = datetime.utcnow()
-    db.commit()
+    # Regenerar el hash si se cambió BCRYPT_ROUNDS (lo único que se escribe en el login)
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+    
+    # Último login: se escribe en diferido; el objeto lo refleja sin marcarse como modificado
+    now = datetime.utcnow()
+    last_login_buffer.record(user.id, now)
+    set_committed_value(user, "last_login", now)
     
     return user
 
@@ -66,41 +195,211 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    # iat con decimales para poder comparar con el momento de una revocación
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Obtener usuario actual desde token JWT"""
-    credentials_exception = HTTPException(
+def create_user_token(user: Usuario, expires_delta: Optional[timedelta] = None) -> str:
+    """Crear token JWT con el id y el estado del usuario, para no consultarlos en cada petición"""
+    return create_access_token(
+        data={"sub": user.email, "uid": user.id, "act": user.is_active},
+        expires_delta=expires_delta
+    )
+
+def _hash_refresh_token(token: str) -> str:
+    """HMAC-SHA256 del refresh token: es lo que se guarda y se busca en la tabla"""
+    return hmac.new(SECRET_KEY.encode("utf-8"), token.encode("utf-8"), hashlib.sha256).hexdigest()
+
+async def create_refresh_token(db: AsyncSession, user_id: int, family: Optional[str] = None) -> str:
+    """
+    Crear un refresh token opaco. Sin `family` empieza una familia nueva (un login);
+    al rotar se mantiene la familia para poder revocarla entera si se reutiliza un token.
+    """
+    if family is None:
+        family = uuid.uuid4().hex
+    # Borrar los tokens caducados del usuario, también al rotar: los ya usados se guardan
+    # para detectar su reutilización, pero solo hasta que caducan
+    await db.execute(delete(RefreshToken).where(
+        RefreshToken.usuario_id == user_id,
+        RefreshToken.expira < datetime.utcnow()
+    ))
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        token_hash=_hash_refresh_token(token),
+        usuario_id=user_id,
+        familia=family,
+        expira=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    await db.commit()
+    return token
+
+async def rotate_refresh_token(db: AsyncSession, token: str) -> Tuple[Usuario, str]:
+    """
+    Canjear un refresh token por uno nuevo de la misma familia (sin bcrypt).
+    Si el token ya se había usado, alguien tiene una copia: se revoca toda la familia.
+    """
+    token_hash = _hash_refresh_token(token)
+    row = (await db.execute(
+        select(RefreshToken, Usuario)
+        .join(Usuario, Usuario.id == RefreshToken.usuario_id)
+        .where(RefreshToken.token_hash == token_hash)
+    )).first()
+    if row is None:
+        raise _credentials_exception()
+    refresh, user = row
+    
+    # Marcar como usado de forma atómica: de dos peticiones simultáneas con el mismo token solo gana una
+    marked = await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.token_hash == token_hash, RefreshToken.usado == False)  # noqa: E712
+        .values(usado=True)
+        .execution_options(synchronize_session=False)
+    )
+    if not marked.rowcount:
+        logger.warning(f"Reutilización de refresh token detectada para el usuario {user.id}, se revoca su familia")
+        await db.execute(delete(RefreshToken).where(RefreshToken.familia == refresh.familia))
+        await db.commit()
+        raise _credentials_exception()
+    
+    issued_at = refresh.created_at.replace(tzinfo=timezone.utc).timestamp() if refresh.created_at else 0
+    revoked = revocation_list.is_revoked({"uid": user.id, "iat": issued_at})
+    if refresh.expira < datetime.utcnow() or not user.is_active or revoked:
+        await db.commit()
+        raise _credentials_exception()
+    
+    return user, await create_refresh_token(db, user.id, family=refresh.familia)
+
+async def revoke_refresh_tokens(db: AsyncSession, user_id: int, token: Optional[str] = None) -> int:
+    """
+    Borrar la familia del refresh token (cierre de sesión en este dispositivo) o,
+    sin token, todas las familias del usuario. Devuelve los tokens borrados.
+    """
+    query = delete(RefreshToken).where(RefreshToken.usuario_id == user_id)
+    if token is not None:
+        family = select(RefreshToken.familia).where(
+            RefreshToken.token_hash == _hash_refresh_token(token),
+            RefreshToken.usuario_id == user_id
+        ).scalar_subquery()
+        query = query.where(RefreshToken.familia == family)
+    result = await db.execute(query.execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudieron validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+def decode_token(token: str) -> dict:
+    """Decodificar y validar un token JWT (firma, expiración y revocación)"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("sub") is None or revocation_list.is_revoked(payload):
+        raise _credentials_exception()
+    return payload
+
+async def _load_user(payload: dict) -> Optional[Usuario]:
+    """Usuario del token: desde la caché o, si no está, desde la base de datos"""
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = user_cache.obtener(str(user_id))
+        if user is not None:
+            return user
+    
+    async def buscar(db: AsyncSession) -> Optional[Usuario]:
+        if user_id is not None:
+            user = await db.get(Usuario, user_id)
+        else:
+            # Tokens emitidos antes de incluir el id
+            user = await db.scalar(select(Usuario).where(Usuario.email == payload["sub"]))
+        if user is not None:
+            # Desligar de la sesión para poder reutilizarlo en otras peticiones
+            db.expunge(user)
+        return user
+    
+    async with enrutador_lecturas.sesion(user_id) as db:
+        user = await buscar(db)
+    if user is None and enrutador_lecturas.replicas:
+        # Usuario recién registrado que aún no ha llegado a la réplica
+        async with AsyncSessionLocal() as db:
+            user = await buscar(db)
+    if user is None:
+        return None
     
-    user = db.query(Usuario).filter(Usuario.email == email).first()
+    user_cache.guardar(str(user.id), user)
+    return user
+
+def invalidate_user(user_id: int, revoke_tokens: bool = False):
+    """
+    Olvidar el usuario cacheado tras modificarlo. Con `revoke_tokens`
+    (p. ej. al desactivarlo) además se rechazan todos sus tokens ya emitidos.
+    """
+    user_cache.eliminar(str(user_id))
+    if revoke_tokens:
+        revocation_list.revoke_user(user_id)
+
+def revoke_token(token: str):
+    """Invalidar un token antes de que expire (cierre de sesión)"""
+    payload = decode_token(token)
+    if payload.get("jti"):
+        revocation_list.revoke_jti(payload["jti"], payload["exp"])
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Obtener usuario actual desde token JWT"""
+    payload = decode_token(token)
+    user = await _load_user(payload)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("uid") is None and revocation_list.is_revoked({"uid": user.id, "iat": payload.get("iat", 0)}):
+        raise _credentials_exception()
     
     return user
 
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    """
+    Obtener solo el id del usuario activo desde el token JWT, sin consultar la base de datos.
+    Para endpoints que únicamente filtran o crean datos del usuario.
+    """
+    payload = decode_token(token)
+    if payload.get("uid") is None:
+        # Token antiguo sin id: resolverlo con el usuario completo
+        user = await get_current_active_user(await get_current_user(token))
+        return user.id
+    if not payload.get("act", True):
+        raise HTTPException(status_code=400, detail="Usuario inactivo")
+    return payload["uid"]
+
+async def get_read_db(user_id: int = Depends(get_current_user_id)):
+    """
+    Sesión de solo lectura para el usuario del token: usa una réplica si las hay,
+    salvo que el usuario haya escrito hace unos segundos (entonces la primaria)
+    """
+    async with enrutador_lecturas.sesion(user_id) as db:
+        yield db
+
+async def get_write_db(user_id: int = Depends(get_current_user_id)):
+    """Sesión en la primaria; sus commits fijan las lecturas del usuario a la primaria un momento"""
+    async with AsyncSessionLocal() as db:
+        db.info["usuario_id"] = user_id
+        yield db
+
 async def get_current_active_user(current_user: Usuario = Depends(get_current_user)):
     """Obtener usuario actual activo"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Usuario inactivo")
     return current_user
 
-def create_user(db: Session, user_data: dict) -> Usuario:
-    """Crear nuevo usuario con contraseña hasheada"""
-    hashed_password = get_password_hash(user_data["password"])
+async def create_user(db: AsyncSession, user_data: dict) -> Usuario:
+    """Crear nuevo usuario con contraseña hasheada (en el pool de procesos)"""
+    try:
+        hashed_password = await password_hasher.hash(user_data["password"])
+    except PoolSaturated:
+        raise _pool_saturated_exception()
     
     db_user = Usuario(
         nombre=user_data["nombre"],
@@ -113,6 +412,6 @@ def create_user(db: Session, user_data: dict) -> Usuario:
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
@@ -0,0 +1,118 @@
+"""
+Benchmark del arranque en frío: cada medición es un proceso nuevo que importa la API
+y prepara la base de datos como lo hacía antes o como lo hace ahora:
+
+- antes: `Base.metadata.create_all` (al importar main.py y otra vez en start.sh)
+- después: una consulta a `schema_version` (verificar_esquema)
+
+Con --latencia-ms se añade un retardo a cada sentencia para simular una base de datos remota:
+
+    python benchmark_arranque.py --repeticiones 5 --latencia-ms 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _simular_latencia(motor, latencia_ms: float):
+    from sqlalchemy import event
+
+    contador = {"sentencias": 0}
+
+    @event.listens_for(motor, "before_cursor_execute")
+    def _retardo(*args):
+        contador["sentencias"] += 1
+        time.sleep(latencia_ms / 1000)
+
+    return contador
+
+
+def hijo(modo: str, latencia_ms: float):
+    """Un arranque medido; imprime los tiempos en JSON"""
+    inicio = time.perf_counter()
+    import main  # noqa: F401
+    from database import Base, async_engine, engine
+    from migraciones import verificar_esquema
+    importado = time.perf_counter()
+
+    if modo == "antes":
+        contador = _simular_latencia(engine, latencia_ms)
+        # start.sh creaba las tablas en un proceso y main.py otra vez al importarse
+        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+    else:
+        contador = _simular_latencia(async_engine.sync_engine, latencia_ms)
+
+        async def verificar():
+            await verificar_esquema(async_engine)
+            await async_engine.dispose()
+
+        asyncio.run(verificar())
+    fin = time.perf_counter()
+
+    print(json.dumps({
+        "importar_ms": (importado - inicio) * 1000,
+        "esquema_ms": (fin - importado) * 1000,
+        "sentencias": contador["sentencias"],
+    }))
+
+
+def medir(modo: str, args) -> dict:
+    resultados = []
+    for _ in range(args.repeticiones):
+        salida = subprocess.run(
+            [sys.executable, __file__, "--hijo", modo, "--latencia-ms", str(args.latencia_ms)],
+            capture_output=True, text=True, check=True
+        )
+        resultados.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+    return {
+        clave: statistics.median(r[clave] for r in resultados)
+        for clave in ("importar_ms", "esquema_ms", "sentencias")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base de datos a usar (por defecto, SQLite temporal)")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="Retardo simulado por sentencia")
+    parser.add_argument("--hijo", choices=["antes", "despues"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        hijo(args.hijo, args.latencia_ms)
+        return
+
+    directorio = None
+    if args.url:
+        os.environ["DATABASE_URL"] = args.url
+    else:
+        directorio = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio.name, 'arranque.db')}"
+    os.environ.pop("DB_AUTO_MIGRAR", None)
+
+    from database import engine
+    from migraciones import migrar
+    migrar(engine)
+    engine.dispose()
+
+    print(f"Arranques en frío: mediana de {args.repeticiones} procesos, latencia simulada {args.latencia_ms} ms/sentencia")
+    for modo, titulo in (("antes", "Antes (create_all)"), ("despues", "Después (schema_version)")):
+        r = medir(modo, args)
+        print(
+            f"  {titulo}: importar {r['importar_ms']:.0f} ms, esquema {r['esquema_ms']:.1f} ms "
+            f"({r['sentencias']:.0f} sentencias), total {r['importar_ms'] + r['esquema_ms']:.0f} ms"
+        )
+
+    if directorio is not None:
+        directorio.cleanup()
+
+
+if __name__ == "__main__":
+    main()
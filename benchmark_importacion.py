@@ -0,0 +1,128 @@
+"""
+Benchmark de POST /gastos/importar: filas por segundo importando un CSV y un NDJSON
+con distintos tamaños de lote, frente a crear los mismos gastos uno a uno con
+POST /gastos/crear-con-decision.
+
+Usa una base de datos SQLite temporal (o la indicada con --url, que debe estar vacía)
+y llama a la API en proceso, sin red:
+
+    python benchmark_importacion.py --filas 20000 --lotes 100,500,1000
+"""
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+DESCRIPCIONES = ["Almuerzo", "Taxi al centro", "Supermercado", "Bus", "Cine", "Cafe", "Gasolina", "Farmacia"]
+CATEGORIAS = ["comida", "transporte", "varios"]
+
+
+def generar_filas(n: int, rng: random.Random) -> list:
+    ahora = datetime.now()
+    return [
+        {
+            "descripcion": rng.choice(DESCRIPCIONES),
+            "monto": round(rng.uniform(1, 200), 2),
+            "categoria": rng.choice(CATEGORIAS),
+            "fecha": (ahora - timedelta(minutes=rng.randint(0, 365 * 24 * 60))).isoformat(timespec="seconds")
+        }
+        for _ in range(n)
+    ]
+
+
+def como_csv(filas: list) -> bytes:
+    lineas = ["descripcion,monto,categoria,fecha"]
+    lineas += [f"{f['descripcion']},{f['monto']},{f['categoria']},{f['fecha']}" for f in filas]
+    return ("\n".join(lineas) + "\n").encode()
+
+
+def como_ndjson(filas: list) -> bytes:
+    return "".join(json.dumps(f) + "\n" for f in filas).encode()
+
+
+async def por_bloques(datos: bytes, tamano: int = 64 * 1024):
+    for i in range(0, len(datos), tamano):
+        yield datos[i:i + tamano]
+
+
+async def medir(args):
+    import httpx
+
+    import importacion
+    import main
+    from auth import create_access_token
+    from database import SessionLocal, engine
+    from migraciones import migrar
+    from models import Usuario
+
+    migrar(engine)
+    with SessionLocal() as db:
+        usuario = Usuario(nombre="Benchmark", email="benchmark@local", password_hash="x", is_active=True)
+        db.add(usuario)
+        db.commit()
+        token = create_access_token({"sub": usuario.email, "uid": usuario.id, "act": True})
+    cabeceras = {"Authorization": f"Bearer {token}"}
+    rng = random.Random(42)
+
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark", timeout=None) as cliente:
+        # Referencia: un gasto por petición
+        filas = generar_filas(args.individuales, rng)
+        inicio = time.perf_counter()
+        for fila in filas:
+            respuesta = await cliente.post("/gastos/crear-con-decision", headers=cabeceras, json={
+                "descripcion": fila["descripcion"], "monto": fila["monto"], "categoria_original": fila["categoria"],
+                "acepta_sugerencia": False, "usuario_id": usuario.id
+            })
+            respuesta.raise_for_status()
+        base = args.individuales / (time.perf_counter() - inicio)
+        print(f"crear-con-decision, uno a uno ({args.individuales} gastos): {base:,.0f} filas/s")
+
+        for lote in args.lotes:
+            importacion.IMPORTACION_LOTE = lote
+            for formato, serializar, tipo in (("csv", como_csv, "text/csv"), ("ndjson", como_ndjson, "application/x-ndjson")):
+                cuerpo = serializar(generar_filas(args.filas, rng))
+                inicio = time.perf_counter()
+                respuesta = await cliente.post(
+                    "/gastos/importar", headers={**cabeceras, "Content-Type": tipo}, content=por_bloques(cuerpo)
+                )
+                duracion = time.perf_counter() - inicio
+                respuesta.raise_for_status()
+                resultado = respuesta.json()
+                velocidad = resultado["importados"] / duracion
+                print(
+                    f"importar {formato:6} lote {lote:5} ({resultado['importados']} gastos, "
+                    f"{len(cuerpo) / 1024:,.0f} KB): {velocidad:,.0f} filas/s (x{velocidad / base:,.0f})"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base de datos vacía para el benchmark (por defecto, SQLite temporal)")
+    parser.add_argument("--filas", type=int, default=20000, help="Gastos por importación")
+    parser.add_argument("--individuales", type=int, default=300, help="Gastos creados uno a uno como referencia")
+    parser.add_argument("--lotes", default="100,500,1000", help="Tamaños de lote (IMPORTACION_LOTE) a comparar")
+    args = parser.parse_args()
+    args.lotes = [int(lote) for lote in args.lotes.split(",")]
+    if args.filas > int(os.getenv("IMPORTACION_MAX_FILAS", "50000")):
+        os.environ["IMPORTACION_MAX_FILAS"] = str(args.filas)
+
+    directorio = None
+    if args.url:
+        os.environ["DATABASE_URL"] = args.url
+    else:
+        directorio = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio.name, 'importacion.db')}"
+
+    asyncio.run(medir(args))
+
+    if directorio is not None:
+        directorio.cleanup()
+
+
+if __name__ == "__main__":
+    main()
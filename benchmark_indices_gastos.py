@@ -0,0 +1,180 @@
+"""
+Benchmark de los índices de `gastos`: planes de consulta, latencia de las consultas
+de `/auth/me/gastos` y velocidad de inserción, antes y después de migraciones.py.
+
+Usa una base de datos SQLite temporal (o la indicada con --url, que debe estar vacía:
+el benchmark crea y elimina índices):
+
+    python benchmark_indices_gastos.py --filas 100000 --usuarios 500
+"""
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+DESCRIPCIONES = ["Almuerzo", "Taxi", "Supermercado", "Bus", "Cine", "Cafe", "Gasolina", "Farmacia", "Pizza", "Metro"]
+
+# Las formas de consulta de obtener_mis_gastos
+CONSULTAS = {
+    "usuario": (
+        "SELECT * FROM gastos WHERE usuario_id = :usuario_id "
+        "ORDER BY fecha DESC, id DESC LIMIT 100"
+    ),
+    "usuario+categoria": (
+        "SELECT * FROM gastos WHERE usuario_id = :usuario_id AND categoria = :categoria "
+        "ORDER BY fecha DESC, id DESC LIMIT 100"
+    ),
+    "usuario+rango": (
+        "SELECT * FROM gastos WHERE usuario_id = :usuario_id AND fecha >= :desde AND fecha <= :hasta "
+        "ORDER BY fecha DESC, id DESC LIMIT 100"
+    ),
+    "usuario+categoria+rango": (
+        "SELECT * FROM gastos WHERE usuario_id = :usuario_id AND categoria = :categoria "
+        "AND fecha >= :desde AND fecha <= :hasta ORDER BY fecha DESC, id DESC LIMIT 100"
+    ),
+}
+
+
+def esquema_anterior(engine):
+    """Dejar `gastos` con los índices de una columna que tenía el modelo"""
+    from migraciones import INDICES_GASTOS_OBSOLETOS
+    from models import Gasto
+
+    with engine.begin() as conexion:
+        for indice in Gasto.__table__.indexes:
+            conexion.execute(text(f"DROP INDEX IF EXISTS {indice.name}"))
+        for nombre in INDICES_GASTOS_OBSOLETOS:
+            columna = nombre[len("ix_gastos_"):]
+            conexion.execute(text(f"CREATE INDEX {nombre} ON gastos ({columna})"))
+
+
+def filas_aleatorias(n: int, usuarios: int, rng: random.Random) -> list:
+    from models import CategoriaGasto
+
+    ahora = datetime.utcnow()
+    return [
+        {
+            "usuario_id": rng.randint(1, usuarios),
+            "descripcion": rng.choice(DESCRIPCIONES),
+            "monto": round(rng.uniform(1, 200), 2),
+            "categoria": rng.choice(list(CategoriaGasto)),
+            "fecha": ahora - timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60)),
+            "created_at": ahora,
+            "updated_at": ahora,
+        }
+        for _ in range(n)
+    ]
+
+
+def insertar(engine, filas: list, lote: int = 1000) -> float:
+    """Insertar en lotes y devolver filas por segundo"""
+    from models import Gasto
+
+    inicio = time.perf_counter()
+    for i in range(0, len(filas), lote):
+        with engine.begin() as conexion:
+            conexion.execute(Gasto.__table__.insert(), filas[i:i + lote])
+    return len(filas) / (time.perf_counter() - inicio)
+
+
+def parametros(usuarios: int, rng: random.Random) -> dict:
+    from models import CategoriaGasto
+
+    hasta = datetime.utcnow() - timedelta(days=rng.randint(0, 300))
+    return {
+        "usuario_id": rng.randint(1, usuarios),
+        "categoria": rng.choice(list(CategoriaGasto)).name,
+        "desde": (hasta - timedelta(days=90)).strftime("%Y-%m-%d %H:%M:%S"),
+        "hasta": hasta.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def plan(engine, sql: str, params: dict) -> str:
+    prefijo = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    with engine.connect() as conexion:
+        filas = conexion.execute(text(prefijo + sql), params).fetchall()
+    return "\n".join("      " + str(fila[-1]) for fila in filas)
+
+
+def latencias(engine, sql: str, usuarios: int, repeticiones: int, rng: random.Random) -> dict:
+    tiempos = []
+    with engine.connect() as conexion:
+        for _ in range(repeticiones):
+            params = parametros(usuarios, rng)
+            inicio = time.perf_counter()
+            conexion.execute(text(sql), params).fetchall()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        "p50": round(statistics.median(tiempos), 3),
+        "p95": round(tiempos[int(len(tiempos) * 0.95) - 1], 3),
+    }
+
+
+def medir(engine, titulo: str, args, rng: random.Random):
+    print(f"\n=== {titulo} ===")
+    indices = sorted(indice["name"] for indice in inspect(engine).get_indexes("gastos"))
+    print(f"Índices: {', '.join(indices)}")
+    velocidad = insertar(engine, filas_aleatorias(args.inserciones, args.usuarios, rng))
+    print(f"Inserción: {velocidad:,.0f} filas/s ({args.inserciones} filas en lotes de 1000)")
+    for nombre, sql in CONSULTAS.items():
+        resultado = latencias(engine, sql, args.usuarios, args.repeticiones, rng)
+        print(f"  {nombre}: p50 {resultado['p50']} ms, p95 {resultado['p95']} ms")
+        print(plan(engine, sql, parametros(args.usuarios, rng)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base de datos vacía para el benchmark (por defecto, SQLite temporal)")
+    parser.add_argument("--filas", type=int, default=50000, help="Gastos iniciales")
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--inserciones", type=int, default=20000, help="Gastos insertados en cada medición")
+    parser.add_argument("--repeticiones", type=int, default=300, help="Consultas por forma de consulta")
+    args = parser.parse_args()
+
+    directorio = None
+    url = args.url
+    if not url:
+        directorio = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(directorio.name, 'benchmark.db')}"
+    # database.py crea su motor al importarse con DATABASE_URL
+    os.environ["DATABASE_URL"] = url
+
+    from database import Base
+    from migraciones import migrar_indices_gastos
+    from models import Gasto, Usuario
+
+    engine = create_engine(url)
+    rng = random.Random(42)
+
+    Base.metadata.create_all(bind=engine, tables=[Usuario.__table__, Gasto.__table__])
+    with engine.begin() as conexion:
+        conexion.execute(Usuario.__table__.insert(), [
+            {"id": i, "nombre": f"Usuario {i}", "email": f"u{i}@benchmark.local", "password_hash": "x", "is_active": True}
+            for i in range(1, args.usuarios + 1)
+        ])
+    esquema_anterior(engine)
+    insertar(engine, filas_aleatorias(args.filas, args.usuarios, rng))
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conexion:
+            conexion.execute(text("ANALYZE"))
+
+    medir(engine, "Antes: índices de una columna", args, rng)
+    with engine.begin() as conexion:
+        migrar_indices_gastos(conexion)
+        if engine.dialect.name == "sqlite":
+            conexion.execute(text("ANALYZE"))
+    medir(engine, "Después: índices compuestos", args, rng)
+
+    engine.dispose()
+    if directorio is not None:
+        directorio.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Modelo sustituto local (vectorizado con NumPy) para predicciones de dificultad Capibara
+"""
+from typing import Any, List, Optional
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Ruta del modelo exportado (.npz o directorio de .npy); sin ella el lote usa el modelo remoto
+CAPIBARA_MODELO_PATH = os.getenv("CAPIBARA_MODELO_PATH")
+
+
+class ModeloCapibaraLocal:
+    """
+    Modelo lineal exportado a un archivo .npz, o a un directorio con un .npy por array
+    (que se cargan con memory mapping para compartir memoria entre workers):
+
+    - `pesos`: (3, k) para clasificación o (3,) para regresión
+    - `sesgo`: (k,) o escalar
+    - `clases` (opcional): etiquetas de las k clases; sin ellas el modelo es de regresión
+    - `media` y `escala` (opcionales): estandarización de las 3 entradas
+      (bombs_hit, projectiles_hit, session_time)
+    """
+
+    def __init__(self, pesos: np.ndarray, sesgo: np.ndarray, clases: Optional[np.ndarray] = None,
+                 media: Optional[np.ndarray] = None, escala: Optional[np.ndarray] = None, ruta: str = None):
+        self.pesos = np.asarray(pesos, dtype=np.float64)
+        self.sesgo = np.asarray(sesgo, dtype=np.float64)
+        self.clases = clases
+        self.media = media
+        self.escala = escala
+        self.ruta = ruta
+
+    @classmethod
+    def cargar(cls, ruta: Optional[str]) -> Optional["ModeloCapibaraLocal"]:
+        """Cargar el modelo desde un .npz o un directorio; devuelve None si no hay ruta o no se puede leer"""
+        if not ruta:
+            return None
+        try:
+            if os.path.isdir(ruta):
+                datos = {
+                    nombre[:-len(".npy")]: np.load(os.path.join(ruta, nombre), mmap_mode="r", allow_pickle=False)
+                    for nombre in os.listdir(ruta) if nombre.endswith(".npy")
+                }
+                modelo = cls(ruta=ruta, **cls._arrays(datos))
+            else:
+                with np.load(ruta, allow_pickle=False) as datos:
+                    modelo = cls(ruta=ruta, **cls._arrays(datos))
+            logger.info(f"Modelo Capibara local cargado desde {ruta}")
+            return modelo
+        except Exception as e:
+            logger.error(f"Error al cargar modelo Capibara local: {str(e)}")
+            return None
+
+    @staticmethod
+    def _arrays(datos) -> dict:
+        return {
+            "pesos": datos["pesos"],
+            "sesgo": datos["sesgo"],
+            "clases": datos["clases"] if "clases" in datos else None,
+            "media": datos["media"] if "media" in datos else None,
+            "escala": datos["escala"] if "escala" in datos else None
+        }
+
+    def predecir_lote(self, entradas: np.ndarray) -> List[Any]:
+        """
+        Predecir para una matriz (n, 3) de sesiones en una sola operación vectorizada.
+        Devuelve las etiquetas de clase (o valores, en regresión) en el mismo orden.
+        """
+        x = np.asarray(entradas, dtype=np.float64).reshape(-1, 3)
+        if self.media is not None:
+            x = x - self.media
+        if self.escala is not None:
+            x = x / self.escala
+
+        salida = x @ self.pesos + self.sesgo
+        if self.clases is None:
+            return np.ravel(salida).tolist()
+        return self.clases[np.argmax(salida, axis=1)].tolist()
+
+    def informacion(self) -> dict:
+        return {
+            "ruta": self.ruta,
+            "tipo": "regresion" if self.clases is None else "clasificacion",
+            "clases": None if self.clases is None else self.clases.tolist()
+        }
@@ -1,22 +1,342 @@
-from sqlalchemy import create_engine
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+import itertools
+import logging
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, ProgrammingError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+from metricas import percentiles_ms
+
 # Cargar variables de entorno
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Opcional: URL del motor asíncrono; por defecto se deriva de DATABASE_URL
+# (sqlite -> sqlite+aiosqlite, postgresql -> postgresql+asyncpg)
+DATABASE_ASYNC_URL = os.getenv("DATABASE_ASYNC_URL")
+
+# Réplicas de lectura (opcional), separadas por comas
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5"))  # Lecturas en la primaria tras escribir
+DB_REPLICA_COOLDOWN_SECONDS = float(os.getenv("DB_REPLICA_COOLDOWN_SECONDS", "30"))  # Réplica fallida fuera de turno
+
+# Pool de conexiones
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Segundos esperando una conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Reabrir conexiones con más antigüedad (segundos)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "si", "yes")
+
+# PRAGMAs de SQLite
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "20000"))
+
+
+class MetricasPool:
+    """Tiempos de espera al pedir una conexión al pool y veces que se agotó el tiempo"""
+
+    def __init__(self, ventana: int = 500):
+        self.esperas = deque(maxlen=ventana)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.espera_maxima = 0.0
+        self._lock = threading.Lock()
+
+    def registrar(self, espera: float, timeout: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.esperas.append(espera)
+            self.espera_maxima = max(self.espera_maxima, espera)
+            if timeout:
+                self.timeouts += 1
+
+
+class _MedirEsperas:
+    """Mide cuánto espera cada petición por una conexión del pool"""
+    metricas: MetricasPool
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except PoolTimeoutError:
+            self.metricas.registrar(time.perf_counter() - inicio, timeout=True)
+            raise
+        self.metricas.registrar(time.perf_counter() - inicio)
+        return conexion
+
+
+class QueuePoolMedido(_MedirEsperas, QueuePool):
+    metricas = MetricasPool()
+
+
+class AsyncQueuePoolMedido(_MedirEsperas, AsyncAdaptedQueuePool):
+    metricas = MetricasPool()
+
+
+def _configurar_sqlite(dbapi_connection, connection_record):
+    # WAL: los lectores no se bloquean mientras hay una escritura en curso
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")  # Seguro con WAL y mucho más rápido que FULL
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def _sqlite_en_memoria(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+
+def _url_asincrona(url: str):
+    """Cambiar el driver de la URL por su equivalente asíncrono; devuelve (url, connect_args)"""
+    url = make_url(url)
+    if url.drivername.startswith("sqlite"):
+        return url.set(drivername="sqlite+aiosqlite"), {}
+    if url.drivername in ("postgres", "postgresql", "postgresql+psycopg2"):
+        url = url.set(drivername="postgresql+asyncpg")
+        # asyncpg no entiende sslmode (opción de libpq): se traduce a connect_args
+        sslmode = url.query.get("sslmode")
+        if sslmode:
+            return url.difference_update_query(["sslmode"]), {"ssl": sslmode}
+    return url, {}
+
+
+opciones_pool = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
 
 # Configuración específica para SQLite si se usa
 if DATABASE_URL and DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
-        DATABASE_URL, 
-        connect_args={"check_same_thread": False}  # Solo para SQLite
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},  # Solo para SQLite
+        # Una base en memoria vive en una única conexión: se deja el pool por defecto
+        **({} if _sqlite_en_memoria(DATABASE_URL) else {"poolclass": QueuePoolMedido, **opciones_pool})
     )
+    event.listen(engine, "connect", _configurar_sqlite)
 else:
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, poolclass=QueuePoolMedido, **opciones_pool)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+def _crear_motor_asincrono(url: str, poolclass=AsyncQueuePoolMedido) -> AsyncEngine:
+    url_asincrona, connect_args = _url_asincrona(url)
+    if url_asincrona.drivername.startswith("sqlite"):
+        motor = create_async_engine(
+            url_asincrona,
+            **({} if _sqlite_en_memoria(url) else {"poolclass": poolclass, **opciones_pool})
+        )
+        event.listen(motor.sync_engine, "connect", _configurar_sqlite)
+        return motor
+    return create_async_engine(url_asincrona, connect_args=connect_args, poolclass=poolclass, **opciones_pool)
+
+
+# Motor asíncrono para los endpoints: las consultas no ocupan hilos del threadpool
+async_engine = _crear_motor_asincrono(DATABASE_ASYNC_URL or DATABASE_URL)
+
+# expire_on_commit=False: los objetos siguen legibles tras el commit sin volver a consultar
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    """Dependencia para obtener una sesión asíncrona de base de datos"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+class SesionReplica(AsyncSession):
+    """
+    Sesión de solo lectura sobre una réplica. Si una consulta falla en la réplica
+    (conexión perdida, o un esquema que aún no tiene la última migración), la réplica
+    queda fuera de turno y la consulta se repite en la primaria.
+    """
+    enrutador: "EnrutadorLecturas"
+    indice: int
+
+    async def _con_respaldo(self, consulta, *args, **kwargs):
+        try:
+            return await consulta(*args, **kwargs)
+        except (OperationalError, ProgrammingError) as e:
+            if self.bind is async_engine:
+                raise
+            self.enrutador.marcar_caida(self.indice, e)
+            self.enrutador.lecturas_repetidas += 1
+            await self.rollback()
+            self.bind = async_engine
+            self.sync_session.bind = async_engine.sync_engine
+            return await consulta(*args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await self._con_respaldo(super().execute, *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await self._con_respaldo(super().scalar, *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self._con_respaldo(super().get, *args, **kwargs)
+
+
+SesionesReplica = async_sessionmaker(class_=SesionReplica, autoflush=False, expire_on_commit=False)
+
+
+class EnrutadorLecturas:
+    """
+    Reparte las sesiones de solo lectura entre las réplicas por turnos.
+
+    - Un usuario que acaba de escribir lee de la primaria durante DB_REPLICA_STICKY_SECONDS,
+      así ve sus propios cambios aunque la réplica vaya con retraso.
+    - Si una réplica no da conexión, queda fuera de turno DB_REPLICA_COOLDOWN_SECONDS
+      y se prueba la siguiente; sin réplicas disponibles se lee de la primaria.
+    - Si una consulta falla en la réplica, esta queda fuera de turno igual y la consulta
+      se repite en la primaria (ver SesionReplica).
+    """
+
+    def __init__(self, replicas: List[AsyncEngine], ventana: float = DB_REPLICA_STICKY_SECONDS,
+                 enfriamiento: float = DB_REPLICA_COOLDOWN_SECONDS):
+        self.replicas = replicas
+        self.ventana = ventana
+        self.enfriamiento = enfriamiento
+        self._turno = itertools.count()
+        self._escrituras: Dict[int, float] = {}  # usuario_id -> momento de su última escritura
+        self._caidas: Dict[int, float] = {}  # índice de réplica -> fuera de turno hasta
+        self._lock = threading.Lock()
+        self.lecturas_replica = 0
+        self.lecturas_primaria = 0
+        self.lecturas_fijadas = 0
+        self.lecturas_repetidas = 0
+        self.fallos_replica = 0
+
+    def registrar_escritura(self, usuario_id: int):
+        ahora = time.monotonic()
+        with self._lock:
+            self._escrituras[usuario_id] = ahora
+            if len(self._escrituras) > 10000:
+                limite = ahora - self.ventana
+                self._escrituras = {u: t for u, t in self._escrituras.items() if t >= limite}
+
+    def _fijado_a_primaria(self, usuario_id: Optional[int]) -> bool:
+        escritura = self._escrituras.get(usuario_id) if usuario_id is not None else None
+        return escritura is not None and time.monotonic() - escritura < self.ventana
+
+    def _candidatas(self) -> List[int]:
+        ahora = time.monotonic()
+        inicio = next(self._turno)
+        orden = [(inicio + i) % len(self.replicas) for i in range(len(self.replicas))]
+        return [i for i in orden if self._caidas.get(i, 0) <= ahora]
+
+    def marcar_caida(self, indice: int, error: Exception):
+        """Dejar una réplica fuera de turno durante el enfriamiento"""
+        self.fallos_replica += 1
+        self._caidas[indice] = time.monotonic() + self.enfriamiento
+        logger.warning(f"Réplica {indice} no disponible, fuera de turno {self.enfriamiento}s: {str(error)}")
+
+    async def _sesion_replica(self) -> Optional[AsyncSession]:
+        for indice in self._candidatas():
+            db = SesionesReplica(bind=self.replicas[indice])
+            db.enrutador, db.indice = self, indice
+            try:
+                # Pedir la conexión ya: si la réplica no responde se prueba otra
+                await db.connection()
+                return db
+            except Exception as e:
+                await db.close()
+                self.marcar_caida(indice, e)
+        return None
+
+    @asynccontextmanager
+    async def sesion(self, usuario_id: Optional[int] = None):
+        """Sesión de solo lectura para el usuario indicado"""
+        db = None
+        if self.replicas:
+            if self._fijado_a_primaria(usuario_id):
+                self.lecturas_fijadas += 1
+            else:
+                db = await self._sesion_replica()
+        if db is None:
+            self.lecturas_primaria += 1
+            db = AsyncSessionLocal()
+        else:
+            self.lecturas_replica += 1
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    def estadisticas(self) -> dict:
+        ahora = time.monotonic()
+        return {
+            "replicas": len(self.replicas),
+            "replicas_fuera_de_turno": sum(1 for hasta in self._caidas.values() if hasta > ahora),
+            "lecturas_replica": self.lecturas_replica,
+            "lecturas_primaria": self.lecturas_primaria,
+            "lecturas_fijadas_tras_escritura": self.lecturas_fijadas,
+            "lecturas_repetidas_en_primaria": self.lecturas_repetidas,
+            "fallos_replica": self.fallos_replica
+        }
+
+
+enrutador_lecturas = EnrutadorLecturas([
+    # Cada réplica con sus propias métricas de pool
+    _crear_motor_asincrono(url, poolclass=type("AsyncQueuePoolMedido", (AsyncQueuePoolMedido,), {"metricas": MetricasPool()}))
+    for url in DATABASE_REPLICA_URLS
+])
+
+
+@event.listens_for(Session, "after_commit")
+def _registrar_escritura_usuario(session):
+    # Las sesiones de escritura de un usuario llevan su id en `info` (ver auth.get_write_db)
+    usuario_id = session.info.get("usuario_id")
+    if usuario_id is not None:
+        enrutador_lecturas.registrar_escritura(usuario_id)
+
+
+def _estadisticas_motor(motor) -> dict:
+    pool = motor.pool
+    metricas_pool = getattr(pool, "metricas", None) or MetricasPool()
+    estado = {
+        "pool": type(pool).__name__,
+        "checkouts": metricas_pool.checkouts,
+        "timeouts": metricas_pool.timeouts,
+        "espera_ms": percentiles_ms(metricas_pool.esperas, decimales=2),
+        "espera_maxima_ms": round(metricas_pool.espera_maxima * 1000, 2)
+    }
+    if isinstance(pool, QueuePool):
+        capacidad = pool.size() + DB_MAX_OVERFLOW
+        estado.update({
+            "tamano": pool.size(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "en_uso": pool.checkedout(),
+            "libres": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "saturacion": round(pool.checkedout() / capacidad, 4) if capacidad else None
+        })
+    return estado
+
+
+def estadisticas_pool() -> dict:
+    """Estado de los pools (síncrono y asíncrono) y tiempos de espera por conexión (p50/p95/p99 en ms)"""
+    return {
+        "sincrono": _estadisticas_motor(engine),
+        "asincrono": _estadisticas_motor(async_engine),
+        "replicas": [_estadisticas_motor(motor) for motor in enrutador_lecturas.replicas],
+        "lecturas": enrutador_lecturas.estadisticas()
+    }
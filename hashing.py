@@ -0,0 +1,126 @@
+"""
+Hashing de contraseñas (bcrypt) en un pool de procesos dedicado.
+
+bcrypt consume 100-300 ms de CPU por operación; ejecutado en los hilos del
+servidor, una ráfaga de logins bloquea al resto de la API. Este módulo es
+ligero a propósito: los procesos del pool se crean con "spawn" y solo lo importan a él.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from passlib.context import CryptContext
+
+from metricas import percentiles_ms
+
+logger = logging.getLogger(__name__)
+
+# Configuración del hashing
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # Coste; al cambiarlo, los hashes se regeneran en el login
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", "64"))  # Operaciones pendientes antes de rechazar
+PASSWORD_METRICS_WINDOW = int(os.getenv("PASSWORD_METRICS_WINDOW", "200"))  # Latencias guardadas para los percentiles
+
+# Mínimo y máximo iguales al coste: un hash con otro coste "necesita actualización"
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PoolSaturated(Exception):
+    """Demasiadas operaciones de hashing pendientes"""
+
+
+# Funciones ejecutadas en los procesos del pool (deben ser de nivel de módulo)
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verificar y, si el hash usa un coste distinto del configurado, devolver uno nuevo"""
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """Pool de procesos acotado para bcrypt, con métricas de cola y latencia"""
+
+    def __init__(self, workers: int = PASSWORD_POOL_WORKERS, max_queue: int = PASSWORD_POOL_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.latencies = deque(maxlen=PASSWORD_METRICS_WINDOW)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Creación diferida: no lanzar procesos al importar
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"Pool de hashing iniciado con {self.workers} procesos (bcrypt rounds={BCRYPT_ROUNDS})")
+            return self._pool
+
+    async def _run(self, func, *args) -> Any:
+        with self._lock:
+            if self.pending >= self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(f"{self.pending} operaciones de hashing pendientes")
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+        inicio = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_pool(), func, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.latencies.append(time.perf_counter() - inicio)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        valido, nuevo_hash = await self._run(_verify_and_update, password, hashed_password)
+        if valido and nuevo_hash:
+            self.rehashed += 1
+        return valido, nuevo_hash
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "workers": self.workers,
+            "pool_iniciado": self._pool is not None,
+            "pendientes": self.pending,
+            "max_pendientes": self.max_pending,
+            "limite_cola": self.max_queue,
+            "completadas": self.completed,
+            "rechazadas": self.rejected,
+            "rehash": self.rehashed,
+            "latencia_ms": percentiles_ms(self.latencies)
+        }
+
+
+password_hasher = PasswordHasher()
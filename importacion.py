@@ -0,0 +1,239 @@
+"""
+Importación masiva de gastos desde CSV o NDJSON, leyendo el cuerpo de la petición por bloques.
+
+Cada fila se valida con las reglas de GastoConDecision. Cuando ya se ha leído todo el
+archivo (y, si se pidió, categorizado con ML), las válidas se insertan en INSERT de varias
+filas (IMPORTACION_LOTE por sentencia) dentro de una sola transacción corta, junto con el
+resumen de gastos y el contador del presupuesto.
+
+- CSV: primera línea con las columnas `descripcion`, `monto` y opcionalmente `categoria` y `fecha`
+- NDJSON: un objeto JSON por línea con las mismas claves
+"""
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import os
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ml_service import ml_service
+from models import CategoriaGasto, Gasto
+from presupuesto import ajustar_gasto_periodo
+from resumenes import ajustar_resumen
+from schemas import GastoConDecision
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la importación
+IMPORTACION_LOTE = int(os.getenv("IMPORTACION_LOTE", "500"))  # Filas por INSERT
+IMPORTACION_MAX_FILAS = int(os.getenv("IMPORTACION_MAX_FILAS", "50000"))  # Filas por archivo
+IMPORTACION_MAX_ERRORES = int(os.getenv("IMPORTACION_MAX_ERRORES", "100"))  # Errores detallados en la respuesta
+
+FORMATOS = ("csv", "ndjson")
+
+
+class ErrorImportacion(Exception):
+    """El archivo no se puede importar (formato o tamaño), no un error de una fila"""
+
+
+async def _lineas(bloques: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Líneas de texto a medida que llegan los bloques (UTF-8, con o sin BOM)"""
+    decodificador = codecs.getincrementaldecoder("utf-8-sig")()
+    pendiente = ""
+    async for bloque in bloques:
+        try:
+            pendiente += decodificador.decode(bloque)
+        except UnicodeDecodeError:
+            raise ErrorImportacion("El archivo debe estar codificado en UTF-8")
+        *completas, pendiente = pendiente.split("\n")
+        for linea in completas:
+            yield linea.rstrip("\r")
+    pendiente += decodificador.decode(b"", final=True)
+    if pendiente:
+        yield pendiente.rstrip("\r")
+
+
+async def leer_filas(bloques: AsyncIterator[bytes], formato: str) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Pares (número de línea, fila) del archivo; la fila es un dict o, si la línea
+    no se puede leer, el ValueError correspondiente. Las líneas en blanco se saltan.
+    """
+    columnas: Optional[List[str]] = None
+    numero = 0
+    async for linea in _lineas(bloques):
+        numero += 1
+        if not linea.strip():
+            continue
+        if formato == "ndjson":
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                yield numero, ValueError("JSON inválido")
+                continue
+            yield numero, fila if isinstance(fila, dict) else ValueError("Se esperaba un objeto JSON")
+            continue
+
+        # CSV: un registro por línea (los campos no pueden contener saltos de línea)
+        valores = next(csv.reader([linea]))
+        if columnas is None:
+            columnas = [columna.strip().lower() for columna in valores]
+            if "descripcion" not in columnas or "monto" not in columnas:
+                raise ErrorImportacion("La cabecera del CSV debe incluir las columnas descripcion y monto")
+            continue
+        if len(valores) != len(columnas):
+            yield numero, ValueError(f"Se esperaban {len(columnas)} columnas y hay {len(valores)}")
+            continue
+        yield numero, dict(zip(columnas, valores))
+
+
+def validar_fila(fila: dict, usuario_id: int) -> dict:
+    """Validar una fila con las reglas de GastoConDecision; lanza ValueError con el motivo"""
+    categoria = str(fila.get("categoria") or "").strip().lower()
+    try:
+        datos = GastoConDecision(
+            descripcion=str(fila.get("descripcion") or ""),
+            monto=fila.get("monto"),
+            categoria_original=categoria or CategoriaGasto.VARIOS.value,
+            acepta_sugerencia=False,
+            usuario_id=usuario_id
+        )
+    except ValidationError as e:
+        # Con los nombres de columna del archivo
+        raise ValueError("; ".join(
+            f"{'categoria' if error['loc'] == ('categoria_original',) else '.'.join(map(str, error['loc']))}: {error['msg']}"
+            for error in e.errors()
+        ))
+
+    fecha = datetime.now()
+    if fila.get("fecha"):
+        try:
+            fecha = datetime.fromisoformat(str(fila["fecha"]).strip().replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError("fecha: formato inválido, use ISO (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)")
+        if fecha.tzinfo is not None:
+            # Las fechas de los gastos se guardan en hora local sin zona
+            fecha = fecha.astimezone().replace(tzinfo=None)
+
+    return {
+        "descripcion": datos.descripcion,
+        "monto": datos.monto,
+        "categoria": datos.categoria_original,
+        "fecha": fecha,
+        "sin_categoria": not categoria
+    }
+
+
+class Importacion:
+    """Estado de una importación: lote en curso, contadores y errores por fila"""
+
+    def __init__(self, db: AsyncSession, usuario_id: int, categorizar: bool = False):
+        self.db = db
+        self.usuario_id = usuario_id
+        self.categorizar = categorizar
+        self.procesadas = 0
+        self.importados = 0
+        self.categorizados_ml = 0
+        self.total_errores = 0
+        self.errores: List[Dict[str, Any]] = []
+        self.presupuesto: Optional[dict] = None
+        self._aprendidos: List[Tuple[str, str]] = []
+
+    def _error(self, numero: int, motivo: str):
+        self.total_errores += 1
+        if len(self.errores) < IMPORTACION_MAX_ERRORES:
+            self.errores.append({"linea": numero, "error": motivo})
+
+    async def _categorizar(self, lote: List[dict]):
+        """Sugerir con ML la categoría de las filas del lote que no la traen"""
+        pendientes = [fila for fila in lote if fila["sin_categoria"]]
+        if not pendientes:
+            return
+        sugerencias = await ml_service.obtener_sugerencias_lote_async(
+            [(fila["descripcion"], fila["categoria"].value) for fila in pendientes],
+            usuario_id=self.usuario_id
+        )
+        for fila, sugerencia in zip(pendientes, sugerencias):
+            if not sugerencia.get("exito"):
+                continue
+            try:
+                fila["categoria"] = CategoriaGasto(sugerencia["recomendacion"]["categoria_sugerida"])
+                self.categorizados_ml += 1
+            except (KeyError, ValueError):
+                pass
+
+    async def _insertar_lote(self, lote: List[dict]):
+        ahora = datetime.now()
+        # executemany: SQLAlchemy lo envía como INSERT de varias filas ("insertmanyvalues")
+        # y reutiliza la sentencia compilada entre lotes
+        await self.db.execute(insert(Gasto.__table__), [
+            {
+                "usuario_id": self.usuario_id,
+                "descripcion": fila["descripcion"],
+                "monto": fila["monto"],
+                "categoria": fila["categoria"],
+                "fecha": fila["fecha"],
+                "created_at": ahora,
+                "updated_at": ahora
+            }
+            for fila in lote
+        ])
+        await ajustar_resumen(self.db, [
+            (self.usuario_id, fila["categoria"], fila["fecha"], 1, fila["monto"]) for fila in lote
+        ])
+        self.presupuesto = await ajustar_gasto_periodo(
+            self.db, self.usuario_id, [(fila["fecha"], fila["monto"]) for fila in lote]
+        )
+        self.importados += len(lote)
+        self._aprendidos.extend((fila["descripcion"], fila["categoria"].value) for fila in lote)
+
+    async def ejecutar(self, bloques: AsyncIterator[bytes], formato: str, atomico: bool = False) -> dict:
+        """
+        Leer, validar e insertar todo el archivo. La transacción solo se abre al final,
+        con las filas ya validadas y categorizadas: mientras llega el cuerpo o se espera
+        al ML no se retiene ningún bloqueo. Con `atomico`, una sola fila con error
+        descarta la importación completa; si no, se importan las filas válidas.
+        """
+        filas: List[dict] = []
+        async for numero, fila in leer_filas(bloques, formato):
+            self.procesadas += 1
+            if self.procesadas > IMPORTACION_MAX_FILAS:
+                raise ErrorImportacion(f"El archivo supera el máximo de {IMPORTACION_MAX_FILAS} filas")
+            try:
+                if isinstance(fila, Exception):
+                    raise fila
+                filas.append(validar_fila(fila, self.usuario_id))
+            except ValueError as e:
+                self._error(numero, str(e))
+        
+        if atomico and self.total_errores:
+            filas = []
+        lotes = [filas[i:i + IMPORTACION_LOTE] for i in range(0, len(filas), IMPORTACION_LOTE)]
+        if self.categorizar:
+            for lote in lotes:
+                await self._categorizar(lote)
+        
+        if lotes:
+            for lote in lotes:
+                await self._insertar_lote(lote)
+            await self.db.commit()
+            # Aprender de las categorías importadas para futuras sugerencias, fuera del bucle de eventos
+            await asyncio.to_thread(ml_service.registrar_categorias_finales, self._aprendidos, self.usuario_id)
+
+        logger.info(
+            f"Importación del usuario {self.usuario_id}: {self.importados} gastos importados, "
+            f"{self.total_errores} filas con error"
+        )
+        return {
+            "procesadas": self.procesadas,
+            "importados": self.importados,
+            "categorizados_ml": self.categorizados_ml,
+            "total_errores": self.total_errores,
+            "errores": self.errores,
+            "presupuesto_restante": self.presupuesto["restante"] if self.presupuesto else None
+        }
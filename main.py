@@ -1,43 +1,91 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, status
+import time
+INICIO_PROCESO = time.perf_counter()  # Para medir el tiempo de arranque
+
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+import asyncio
+import base64
 import json
+import logging
+import threading
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
 # Importaciones locales
-from database import SessionLocal, engine, Base
-from models import Gasto, Usuario, CategoriaGasto
+from database import SessionLocal, engine, async_engine, estadisticas_pool, get_async_db, enrutador_lecturas
+from models import Gasto, Usuario, CategoriaGasto, PeriodoPresupuesto
 from schemas import (
     Gasto as GastoSchema,
-    UsuarioCreate, UsuarioResponse, UsuarioLogin, UsuarioUpdate, Token, TokenWithUser,
+    UsuarioCreate, UsuarioResponse, UsuarioLogin, UsuarioUpdate, Token, TokenWithUser, RefreshTokenRequest,
     SugerenciaRequest, SugerenciaResponse,
-    GastoConDecision
+    GastoConDecision, GastoCreado, PaginaGastos, ResumenPeriodo, EstadoPresupuesto, ResultadoImportacion,
+    LOTE_MAX_ELEMENTOS
 )
 from auth import (
-    authenticate_user, create_access_token, create_user,
-    get_current_active_user, ACCESS_TOKEN_EXPIRE_MINUTES
+    authenticate_user, create_user_token, create_user, invalidate_user, revoke_token,
+    create_refresh_token, rotate_refresh_token, revoke_refresh_tokens,
+    get_current_active_user, get_current_user_id, get_read_db, get_write_db, oauth2_scheme, last_login_buffer,
+    ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from ml_service import ml_service, capibara_service
+from ml_service import ml_service, capibara_service, monitor_salud, ESTADO_INICIALIZANDO, LoteDemasiadoGrande
+from hashing import password_hasher
+from migraciones import DB_AUTO_MIGRAR, migrar, verificar_esquema
+from resumenes import ajustar_resumen, consultar_resumen
+from presupuesto import ajustar_gasto_periodo, estado_presupuesto, recalcular_gasto_periodo
+from importacion import FORMATOS, ErrorImportacion, Importacion
 
-# Crear tablas
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    title="Money Manager G5 API",
-    description="API para gestión de gastos con Machine Learning",
-    version="1.0.0"
-)
-
-# Dependencia para sesión de DB
-def get_db():
+def cargar_historial_ml():
+    """Entrenar el clasificador local y la memoria por usuario con el historial de gastos"""
     db = SessionLocal()
     try:
-        yield db
+        ml_service.cargar_historial(db)
+    except Exception as e:
+        logger.error(f"Error entrenando clasificador local: {str(e)}")
     finally:
         db.close()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El esquema se migra en el despliegue (migraciones.py); aquí solo se comprueba su versión
+    if DB_AUTO_MIGRAR:
+        await asyncio.to_thread(migrar, engine)
+    await verificar_esquema(async_engine)
+    
+    # Entrenar en segundo plano para no retrasar el arranque
+    threading.Thread(target=cargar_historial_ml, daemon=True).start()
+    ml_service.inicializar()
+    capibara_service.inicializar()
+    monitor_salud.iniciar()
+    last_login_buffer.start()
+    
+    app.state.tiempo_arranque = time.perf_counter() - INICIO_PROCESO
+    logger.info(f"API lista en {app.state.tiempo_arranque:.2f}s")
+    yield
+    await monitor_salud.detener()
+    await ml_service.cerrar()
+    await capibara_service.cerrar()
+    await asyncio.to_thread(ml_service.cache.detener)
+    await asyncio.to_thread(capibara_service.cache.detener)
+    password_hasher.shutdown()
+    last_login_buffer.stop()
+    await async_engine.dispose()
+    for replica in enrutador_lecturas.replicas:
+        await replica.dispose()
+
+app = FastAPI(
+    title="Money Manager G5 API",
+    description="API para gestión de gastos con Machine Learning",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
 # ========================
 # ENDPOINTS DE AUTENTICACIÓN
 # ========================
@@ -46,8 +94,8 @@ def get_db():
 @app.post("/auth/update-profile", response_model=UsuarioResponse)
 async def actualizar_perfil_usuario_post(
     usuario_update: UsuarioUpdate,
-    current_user: Usuario = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """
     Actualizar los datos del usuario autenticado (POST).
@@ -55,25 +103,29 @@ async def actualizar_perfil_usuario_post(
     """
     try:
         # Recargar el usuario desde la sesión actual para evitar problemas de persistencia
-        user_db = db.query(Usuario).filter(Usuario.id == current_user.id).first()
+        user_db = await db.get(Usuario, usuario_id)
         if not user_db:
             raise HTTPException(status_code=404, detail="Usuario no encontrado en la sesión actual")
+        periodo_anterior = user_db.periodo_presupuesto
         update_data = usuario_update.dict(exclude_unset=True)
         for field, value in update_data.items():
             if value is not None:
                 setattr(user_db, field, value)
+        if user_db.periodo_presupuesto != periodo_anterior:
+            await recalcular_gasto_periodo(db, user_db)
         user_db.updated_at = datetime.now()
-        db.commit()
-        db.refresh(user_db)
+        await db.commit()
+        await db.refresh(user_db)
+        invalidate_user(user_db.id)
         return user_db
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/auth/register", response_model=UsuarioResponse)
-def registrar_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
+async def registrar_usuario(usuario: UsuarioCreate, db: AsyncSession = Depends(get_async_db)):
     """Registrar un nuevo usuario"""
     # Verificar si el email ya existe
-    db_usuario = db.query(Usuario).filter(Usuario.email == usuario.email).first()
+    db_usuario = await db.scalar(select(Usuario).where(Usuario.email == usuario.email))
     if db_usuario:
         raise HTTPException(
             status_code=400, 
@@ -81,13 +133,13 @@ def registrar_usuario(usuario: UsuarioCreate, db: Session = Depends(get_db)):
         )
     
     # Crear usuario con contraseña hasheada
-    db_usuario = create_user(db, usuario.dict())
+    db_usuario = await create_user(db, usuario.dict())
     return db_usuario
 
 @app.post("/auth/login", response_model=Token)
-def login_usuario(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_usuario(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """Login de usuario y generación de token"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -96,73 +148,109 @@ def login_usuario(form_data: OAuth2PasswordRequestForm = Depends(), db: Session
         )
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_token(user, expires_delta=access_token_expires)
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
         "user_id": user.id,
-        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": await create_refresh_token(db, user.id)
     }
 
 @app.post("/auth/login-json", response_model=TokenWithUser)
-def login_usuario_json(usuario_login: UsuarioLogin, db: Session = Depends(get_db)):
+async def login_usuario_json(usuario_login: UsuarioLogin, db: AsyncSession = Depends(get_async_db)):
     """Login de usuario con JSON (para apps móviles) - Devuelve token + información del usuario"""
-    user = authenticate_user(db, usuario_login.email, usuario_login.password)
+    user = await authenticate_user(db, usuario_login.email, usuario_login.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos"
         )
     
-    # Actualizar último login
-    user.last_login = datetime.now()
-    db.commit()
-    db.refresh(user)
-    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    access_token = create_user_token(user, expires_delta=access_token_expires)
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
         "user_id": user.id,
         "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": await create_refresh_token(db, user.id),
         "user": user
     }
 
+@app.post("/auth/refresh", response_model=Token)
+async def renovar_token(datos: RefreshTokenRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Obtener un nuevo access token con el refresh token, sin volver a enviar la contraseña.
+    El refresh token usado queda invalidado y se devuelve uno nuevo (rotación).
+    """
+    user, refresh_token = await rotate_refresh_token(db, datos.refresh_token)
+    access_token = create_user_token(user, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user_id": user.id,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": refresh_token
+    }
+
 @app.get("/auth/me", response_model=UsuarioResponse)
-def obtener_usuario_actual(current_user: Usuario = Depends(get_current_active_user)):
+async def obtener_usuario_actual(current_user: Usuario = Depends(get_current_active_user)):
     """Obtener información del usuario autenticado"""
     return current_user
 
 @app.patch("/auth/me", response_model=UsuarioResponse)
-def actualizar_perfil_usuario(
+async def actualizar_perfil_usuario(
     usuario_update: UsuarioUpdate,
-    current_user: Usuario = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """Actualizar perfil del usuario autenticado (PATCH - solo campos enviados)"""
     
+    # Cargar la fila en esta sesión (el token solo aporta el id)
+    user_db = await db.get(Usuario, usuario_id)
+    if not user_db:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    
     # Actualizar solo los campos proporcionados (exclude_unset=True)
+    periodo_anterior = user_db.periodo_presupuesto
     update_data = usuario_update.dict(exclude_unset=True)
     
     for field, value in update_data.items():
         if value is not None:
-            setattr(current_user, field, value)
+            setattr(user_db, field, value)
+    
+    # Otro tipo de periodo: el contador de gasto se recalcula para el nuevo
+    if user_db.periodo_presupuesto != periodo_anterior:
+        await recalcular_gasto_periodo(db, user_db)
     
     # Actualizar timestamp
-    current_user.updated_at = datetime.now()
+    user_db.updated_at = datetime.now()
     
     # Guardar cambios
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(user_db)
+    invalidate_user(user_db.id)
     
-    return current_user
+    return user_db
+
+@app.post("/auth/logout")
+async def cerrar_sesion(
+    datos: Optional[RefreshTokenRequest] = None,
+    token: str = Depends(oauth2_scheme),
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    Invalidar el token actual antes de que expire, junto con sus refresh tokens:
+    los del mismo login si se envía el refresh token o, si no, todos los del usuario
+    """
+    await revoke_refresh_tokens(db, usuario_id, datos.refresh_token if datos else None)
+    revoke_token(token)
+    return {"message": "Sesión cerrada exitosamente"}
 
 
 
@@ -178,43 +266,78 @@ def actualizar_perfil_usuario(
 from fastapi import Body
 from schemas import GastoUpdate
 
+async def _bloquear_gasto(db: AsyncSession, usuario_id: int, gasto_id: int) -> Optional[Gasto]:
+    """
+    Gasto del usuario con su fila bloqueada hasta el commit, o None si no existe.
+    El bloqueo lo toma un UPDATE inicial, que sirve en cualquier motor: SQLite no tiene
+    SELECT ... FOR UPDATE y sus lecturas ni siquiera abren transacción.
+    """
+    bloqueado = await db.scalar(
+        update(Gasto)
+        .where(Gasto.id == gasto_id, Gasto.usuario_id == usuario_id)
+        .values(updated_at=datetime.now())
+        .returning(Gasto.id)
+        .execution_options(synchronize_session=False)
+    )
+    if bloqueado is None:
+        return None
+    return await db.scalar(select(Gasto).where(Gasto.id == gasto_id).execution_options(populate_existing=True))
+
 @app.post("/auth/gastos/update", response_model=GastoSchema)
-def editar_gasto_usuario(
+async def editar_gasto_usuario(
     gasto_id: int = Body(..., embed=True, description="ID del gasto a editar"),
     gasto_update: GastoUpdate = Body(...),
-    current_user: Usuario = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """
     Editar un gasto del usuario autenticado. Solo se modifican los campos enviados.
     """
-    gasto = db.query(Gasto).filter(Gasto.id == gasto_id, Gasto.usuario_id == current_user.id).first()
+    # Con la fila bloqueada, dos ediciones simultáneas no parten del mismo monto y categoría
+    # anteriores, que descuadrarían el resumen de gastos y el contador del presupuesto
+    gasto = await _bloquear_gasto(db, usuario_id, gasto_id)
     if not gasto:
         raise HTTPException(status_code=404, detail="Gasto no encontrado")
+    descripcion_anterior, categoria_anterior, monto_anterior = gasto.descripcion, gasto.categoria, gasto.monto
     update_data = gasto_update.dict(exclude_unset=True)
     for field, value in update_data.items():
         if value is not None:
             setattr(gasto, field, value)
     gasto.updated_at = datetime.now()
-    db.commit()
-    db.refresh(gasto)
+    # Mover el gasto en el resumen: restar los valores anteriores y sumar los nuevos
+    await ajustar_resumen(db, [
+        (usuario_id, categoria_anterior, gasto.fecha, -1, -monto_anterior),
+        (usuario_id, gasto.categoria, gasto.fecha, 1, gasto.monto)
+    ])
+    if gasto.monto != monto_anterior:
+        await ajustar_gasto_periodo(db, usuario_id, [(gasto.fecha, gasto.monto - monto_anterior)])
+    await db.commit()
+    await db.refresh(gasto)
+    # Mantener al día el historial del usuario que usan las sugerencias de ML
+    if (gasto.descripcion, gasto.categoria) != (descripcion_anterior, categoria_anterior):
+        ml_service.olvidar_categoria(usuario_id, descripcion_anterior, categoria_anterior.value)
+        ml_service.recordar_categoria(usuario_id, gasto.descripcion, gasto.categoria.value, gasto.fecha)
     return gasto
 
 # Endpoint para eliminar un gasto del usuario autenticado
 @app.post("/auth/gastos/delete")
-def eliminar_gasto_usuario(
+async def eliminar_gasto_usuario(
     gasto_id: int = Body(..., embed=True, description="ID del gasto a eliminar"),
-    current_user: Usuario = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """
     Eliminar un gasto del usuario autenticado por su ID.
     """
-    gasto = db.query(Gasto).filter(Gasto.id == gasto_id, Gasto.usuario_id == current_user.id).first()
+    # Con la fila bloqueada, un segundo borrado simultáneo no la encuentra y no resta dos veces
+    gasto = await _bloquear_gasto(db, usuario_id, gasto_id)
     if not gasto:
         raise HTTPException(status_code=404, detail="Gasto no encontrado")
-    db.delete(gasto)
-    db.commit()
+    await db.delete(gasto)
+    await ajustar_resumen(db, [(usuario_id, gasto.categoria, gasto.fecha, -1, -gasto.monto)])
+    await ajustar_gasto_periodo(db, usuario_id, [(gasto.fecha, -gasto.monto)])
+    await db.commit()
+    ml_service.olvidar_categoria(usuario_id, gasto.descripcion, gasto.categoria.value)
     return {"message": "Gasto eliminado exitosamente", "id": gasto_id}
 
 @app.get("/")
@@ -227,52 +350,156 @@ def root():
             "auth": "/auth/*",
             "flujo_gastos": [
                 "POST /ml/verificar-categoria",
-                "POST /gastos/crear-con-decision"
+                "POST /ml/verificar-categoria/lote",
+                "POST /gastos/crear-con-decision",
+                "POST /gastos/importar"
             ],
-            "consultas": "GET /auth/me/gastos",
-            "utilidades": "GET /ml/estado",
+            "consultas": ["GET /auth/me/gastos", "GET /auth/me/resumen", "GET /auth/me/presupuesto"],
+            "utilidades": ["GET /ml/estado", "GET /metricas"],
             "docs": "/docs"
         }
     }
 
-@app.get("/auth/me/gastos", response_model=List[GastoSchema])
-def obtener_mis_gastos(
-    limite: int = 100,
-    offset: int = 0,
-    categoria: Optional[CategoriaGasto] = None,
-    fecha_desde: Optional[str] = None,
-    fecha_hasta: Optional[str] = None,
-    current_user: Usuario = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+@app.get("/metricas")
+def obtener_metricas():
+    """Métricas internas del servidor: pool de la base de datos, hashing de contraseñas y escritura diferida de last_login"""
+    return {
+        "base_datos": estadisticas_pool(),
+        "hashing": password_hasher.metrics(),
+        "last_login": last_login_buffer.metrics()
+    }
+
+def _codificar_cursor(gasto: Gasto) -> str:
+    """Cursor opaco con la posición (fecha, id) del último gasto de la página"""
+    datos = json.dumps([gasto.fecha.isoformat(), gasto.id]).encode()
+    return base64.urlsafe_b64encode(datos).decode().rstrip("=")
+
+def _decodificar_cursor(cursor: str):
+    try:
+        fecha, gasto_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(fecha), int(gasto_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+async def _consultar_mis_gastos(
+    db: AsyncSession,
+    usuario_id: int,
+    limite: int,
+    offset: int,
+    cursor: Optional[str],
+    categoria: Optional[CategoriaGasto],
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str]
 ):
-    """Obtener todos los gastos del usuario autenticado con filtros opcionales"""
+    """Una página de gastos del usuario y el cursor de la siguiente (None si no hay más)"""
     
     # Construir query base
-    query = db.query(Gasto).filter(Gasto.usuario_id == current_user.id)
+    query = select(Gasto).where(Gasto.usuario_id == usuario_id)
     
     # Aplicar filtros opcionales
     if categoria:
-        query = query.filter(Gasto.categoria == categoria)
+        query = query.where(Gasto.categoria == categoria)
     
     if fecha_desde:
         try:
             fecha_desde_dt = datetime.fromisoformat(fecha_desde.replace('Z', '+00:00'))
-            query = query.filter(Gasto.fecha >= fecha_desde_dt)
+            query = query.where(Gasto.fecha >= fecha_desde_dt)
         except ValueError:
             raise HTTPException(status_code=400, detail="Formato de fecha_desde inválido. Use ISO format")
     
     if fecha_hasta:
         try:
             fecha_hasta_dt = datetime.fromisoformat(fecha_hasta.replace('Z', '+00:00'))
-            query = query.filter(Gasto.fecha <= fecha_hasta_dt)
+            query = query.where(Gasto.fecha <= fecha_hasta_dt)
         except ValueError:
             raise HTTPException(status_code=400, detail="Formato de fecha_hasta inválido. Use ISO format")
     
-    # Ordenar por fecha descendente y aplicar límites
-    gastos = query.order_by(Gasto.fecha.desc()).offset(offset).limit(limite).all()
+    if cursor:
+        # Continuar justo después del último gasto entregado: una búsqueda en el índice
+        # (usuario_id, [categoria,] fecha DESC, id DESC), sin recorrer las páginas anteriores
+        fecha_cursor, id_cursor = _decodificar_cursor(cursor)
+        query = query.where(tuple_(Gasto.fecha, Gasto.id) < tuple_(fecha_cursor, id_cursor))
+    elif offset:
+        query = query.offset(offset)
     
+    # Ordenar por fecha descendente (el id desempata) y pedir uno más para saber si hay otra página
+    gastos = (await db.scalars(query.order_by(Gasto.fecha.desc(), Gasto.id.desc()).limit(limite + 1))).all()
+    if len(gastos) > limite:
+        gastos = gastos[:limite]
+        return gastos, _codificar_cursor(gastos[-1])
+    return gastos, None
+
+@app.get("/auth/me/gastos", response_model=List[GastoSchema])
+async def obtener_mis_gastos(
+    response: Response,
+    limite: int = Query(100, ge=1),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    categoria: Optional[CategoriaGasto] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Obtener los gastos del usuario autenticado con filtros opcionales.
+    El cursor de la página siguiente va en la cabecera X-Next-Cursor; con `cursor` se ignora `offset`.
+    """
+    gastos, siguiente = await _consultar_mis_gastos(
+        db, usuario_id, limite, offset, cursor, categoria, fecha_desde, fecha_hasta
+    )
+    if siguiente:
+        response.headers["X-Next-Cursor"] = siguiente
     return gastos
 
+@app.get("/auth/me/gastos/pagina", response_model=PaginaGastos)
+async def obtener_pagina_mis_gastos(
+    limite: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    categoria: Optional[CategoriaGasto] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Gastos del usuario paginados por cursor, con `next_cursor` en el cuerpo"""
+    gastos, siguiente = await _consultar_mis_gastos(
+        db, usuario_id, limite, 0, cursor, categoria, fecha_desde, fecha_hasta
+    )
+    return PaginaGastos(gastos=gastos, next_cursor=siguiente)
+
+@app.get("/auth/me/presupuesto", response_model=EstadoPresupuesto)
+async def obtener_estado_presupuesto(
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Presupuesto del usuario y lo gastado en el periodo actual, desde su contador (sin sumar gastos)"""
+    fila = (await db.execute(
+        select(Usuario.presupuesto, Usuario.periodo_presupuesto, Usuario.inicio_periodo, Usuario.gasto_periodo)
+        .where(Usuario.id == usuario_id)
+    )).first()
+    if fila is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return estado_presupuesto(*fila)
+
+@app.get("/auth/me/resumen", response_model=List[ResumenPeriodo])
+async def obtener_resumen_gastos(
+    periodo: PeriodoPresupuesto = PeriodoPresupuesto.MENSUAL,
+    fecha: Optional[str] = None,
+    periodos: int = Query(1, ge=1, le=36),
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Totales por categoría del periodo (diario, semanal o mensual) que contiene `fecha`
+    (hoy por defecto) y de los `periodos - 1` anteriores, leídos del resumen precalculado
+    """
+    try:
+        fecha_dt = datetime.fromisoformat(fecha.replace('Z', '+00:00')) if fecha else datetime.now()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de fecha inválido. Use ISO format")
+    return await consultar_resumen(db, usuario_id, periodo, fecha_dt, periodos)
+
 # ========================
 # ENDPOINTS DE MACHINE LEARNING
 # ========================
@@ -280,16 +507,45 @@ def obtener_mis_gastos(
 
 
 @app.get("/ml/estado")
-def obtener_estado_ml():
+async def obtener_estado_ml(forzar: bool = False):
     """
-    Verificar el estado del servicio de Machine Learning
+    Verificar el estado del servicio de Machine Learning.
+    
+    Por defecto devuelve la última instantánea del monitor de salud, que sondea
+    los modelos en segundo plano. Con `forzar=true` lanza antes esa misma sonda en vivo.
     """
     try:
-        estado = ml_service.probar_conexion()
+        if forzar:
+            await asyncio.gather(monitor_salud.sondear(ml_service), monitor_salud.sondear(capibara_service))
+        salud_ml = monitor_salud.instantanea(ml_service.nombre)
+        disponible = bool(salud_ml["disponible"])
+        estado = {
+            "disponible": disponible,
+            "modelo": ml_service.model_space,
+            **ml_service.estado_servicio(),
+            "cache": ml_service.cache.estadisticas(),
+            "clasificador_local": ml_service.clasificador.estadisticas(),
+            "memoria_usuarios": ml_service.memoria.estadisticas(),
+            "coalescencia": ml_service.vuelo_unico.estadisticas()
+        }
+        estado["salud"] = salud_ml
+        
+        if disponible:
+            servicio = "activo"
+        elif ml_service.estado_cliente == ESTADO_INICIALIZANDO or salud_ml["disponible"] is None:
+            servicio = "inicializando"
+        else:
+            servicio = "inactivo"
         return {
-            "servicio_ml": "activo" if estado["disponible"] else "inactivo",
+            "servicio_ml": servicio,
             "modelo": estado["modelo"],
-            "detalles": estado
+            "detalles": estado,
+            "capibara": {
+                **capibara_service.estado_servicio(),
+                "cache": capibara_service.cache.estadisticas(),
+                "salud": monitor_salud.instantanea(capibara_service.nombre)
+            },
+            "tiempo_arranque": getattr(app.state, "tiempo_arranque", None)
         }
     except Exception as e:
         return {
@@ -303,9 +559,9 @@ def obtener_estado_ml():
 # ========================
 
 @app.post("/ml/verificar-categoria", response_model=SugerenciaResponse)
-def verificar_categoria_con_ml(
+async def verificar_categoria_con_ml(
     datos: SugerenciaRequest,
-    current_user: Usuario = Depends(get_current_active_user)
+    usuario_id: int = Depends(get_current_user_id)
 ):
     """
     🔍 PASO 1: Verificar categoría con ML (cuando usuario hace clic en "Guardar")
@@ -325,9 +581,10 @@ def verificar_categoria_con_ml(
         categoria_str = datos.categoria_usuario.value
         
         # Obtener sugerencia del modelo ML
-        resultado = ml_service.obtener_sugerencia_categoria(
+        resultado = await ml_service.obtener_sugerencia_categoria_async(
             descripcion=datos.descripcion,
-            categoria_usuario=categoria_str
+            categoria_usuario=categoria_str,
+            usuario_id=usuario_id
         )
         
         return resultado
@@ -338,11 +595,66 @@ def verificar_categoria_con_ml(
             detail=f"Error al verificar categoría con ML: {str(e)}"
         )
 
-@app.post("/gastos/crear-con-decision", response_model=GastoSchema)
-def crear_gasto_con_decision_final(
+@app.post("/ml/verificar-categoria/lote", response_model=List[SugerenciaResponse])
+async def verificar_categorias_lote(
+    datos: List[SugerenciaRequest],
+    usuario_id: int = Depends(get_current_user_id)
+):
+    """
+    🔍 PASO 1 (lote): Verificar varias categorías con ML en una sola llamada
+    
+    Pensado para apps móviles que sincronizan gastos creados sin conexión.
+    Devuelve una respuesta por elemento, en el mismo orden que la petición.
+    Los elementos repetidos se consultan una sola vez y si el modelo falla
+    para uno de ellos, solo ese elemento recibe la respuesta de respaldo.
+    """
+    if not datos:
+        raise HTTPException(status_code=400, detail="Debe proporcionar al menos un gasto")
+    if len(datos) > LOTE_MAX_ELEMENTOS:
+        raise HTTPException(status_code=400, detail=f"No se pueden verificar más de {LOTE_MAX_ELEMENTOS} gastos a la vez")
+    
+    try:
+        return await ml_service.obtener_sugerencias_lote_async(
+            [(item.descripcion, item.categoria_usuario.value) for item in datos],
+            usuario_id=usuario_id
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al verificar categorías con ML: {str(e)}"
+        )
+
+@app.post("/gastos/importar", response_model=ResultadoImportacion)
+async def importar_gastos(
+    request: Request,
+    formato: Optional[str] = Query(None, description="csv o ndjson; por defecto según el Content-Type"),
+    categorizar: bool = Query(False, description="Sugerir con ML la categoría de las filas que no la traen"),
+    atomico: bool = Query(False, description="Si alguna fila tiene errores, no importar ninguna"),
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    📥 Importar muchos gastos de una vez desde un CSV o NDJSON enviado como cuerpo de la petición.
+    
+    El archivo se lee por bloques mientras llega y se valida entero; después las filas válidas
+    se insertan por lotes en una sola transacción corta y las inválidas se devuelven con su
+    número de línea y el motivo.
+    """
+    if formato is None:
+        tipo = request.headers.get("content-type", "")
+        formato = "ndjson" if "ndjson" in tipo or "json" in tipo else "csv"
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}. Use csv o ndjson")
+    try:
+        return await Importacion(db, usuario_id, categorizar=categorizar).ejecutar(request.stream(), formato, atomico=atomico)
+    except ErrorImportacion as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/gastos/crear-con-decision", response_model=GastoCreado)
+async def crear_gasto_con_decision_final(
     datos: GastoConDecision,
-    current_user: Usuario = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    usuario_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """
     💾 PASO 2: Crear gasto con decisión del usuario (cuando hace clic en "Aceptar" o "Ignorar")
@@ -374,16 +686,26 @@ def crear_gasto_con_decision_final(
             descripcion=datos.descripcion,
             monto=datos.monto,
             categoria=categoria_final,
-            usuario_id=current_user.id,  # Usuario autenticado automáticamente
+            usuario_id=usuario_id,  # Usuario autenticado automáticamente
             fecha=datetime.now()
         )
         
-        # Guardar en base de datos
+        # Guardar en base de datos, junto con el resumen del usuario
         db.add(nuevo_gasto)
-        db.commit()
-        db.refresh(nuevo_gasto)
+        await ajustar_resumen(db, [(usuario_id, categoria_final, nuevo_gasto.fecha, 1, nuevo_gasto.monto)])
+        # El mismo UPDATE devuelve el estado del presupuesto: sin consulta extra
+        estado = await ajustar_gasto_periodo(db, usuario_id, [(nuevo_gasto.fecha, nuevo_gasto.monto)])
+        await db.commit()
+        await db.refresh(nuevo_gasto)
+        
+        # Aprender de la decisión final para futuras sugerencias
+        ml_service.registrar_categoria_final(datos.descripcion, categoria_final.value, usuario_id=usuario_id)
         
-        return nuevo_gasto
+        respuesta = GastoCreado.model_validate(nuevo_gasto)
+        if estado:
+            respuesta.presupuesto_restante = estado["restante"]
+            respuesta.gastado_periodo = estado["gastado"]
+        return respuesta
         
     except HTTPException:
         # Re-lanzar HTTPExceptions
@@ -410,18 +732,54 @@ class CapibaraPredictRequest(BaseModel):
     session_time: float
 
 @app.post("/ml/capibara-predict")
-def predecir_dificultad_capibara(
+async def predecir_dificultad_capibara(
     datos: CapibaraPredictRequest = Body(...)
 ):
     """
     Realiza una predicción de dificultad usando el modelo CapibaraModel.
     """
     try:
-        resultado = capibara_service.predecir_dificultad(
+        resultado = await capibara_service.predecir_dificultad_async(
             bombs_hit=datos.bombs_hit,
             projectiles_hit=datos.projectiles_hit,
             session_time=datos.session_time
         )
         return resultado
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al predecir dificultad con CapibaraModel: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error al predecir dificultad con CapibaraModel: {str(e)}")
+
+class CapibaraLoteRequest(BaseModel):
+    sesiones: List[CapibaraPredictRequest]
+    validar: int = 0  # Sesiones a comparar con el modelo remoto (solo con modelo local)
+    
+    @validator('sesiones')
+    def validar_sesiones(cls, v):
+        if not v:
+            raise ValueError('Debe proporcionar al menos una sesión')
+        if len(v) > 10000:
+            raise ValueError('No se pueden predecir más de 10000 sesiones a la vez')
+        return v
+    
+    @validator('validar')
+    def validar_muestra(cls, v):
+        if v < 0 or v > LOTE_MAX_ELEMENTOS:
+            raise ValueError(f'validar debe estar entre 0 y {LOTE_MAX_ELEMENTOS}')
+        return v
+
+@app.post("/ml/capibara-predict/lote")
+async def predecir_dificultad_capibara_lote(
+    datos: CapibaraLoteRequest = Body(...)
+):
+    """
+    Predice la dificultad de muchas sesiones en una sola llamada (fin de partida).
+    Devuelve las predicciones en el mismo orden que las sesiones recibidas.
+    """
+    try:
+        return await capibara_service.predecir_lote_async(
+            [(s.bombs_hit, s.projectiles_hit, s.session_time) for s in datos.sesiones],
+            validar=datos.validar
+        )
+    except LoteDemasiadoGrande as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al predecir dificultad en lote con CapibaraModel: {str(e)}")
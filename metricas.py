@@ -0,0 +1,23 @@
+"""
+Percentiles de latencia para las métricas de la API (modelos de ML, hashing y pool de conexiones)
+"""
+from typing import Dict, Iterable, List, Optional
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por el método del rango más cercano"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def percentiles_ms(segundos: Iterable[float], decimales: int = 1) -> Dict[str, Optional[float]]:
+    """p50, p95 y p99 en milisegundos de una serie de duraciones en segundos"""
+    valores_ms = [s * 1000 for s in segundos]
+    percentiles = {}
+    for p in (50, 95, 99):
+        valor = percentil(valores_ms, p)
+        percentiles[f"p{p}"] = round(valor, decimales) if valor is not None else None
+    return percentiles
@@ -0,0 +1,180 @@
+"""
+Migraciones versionadas del esquema.
+
+Se ejecutan una vez por despliegue, antes de arrancar el servidor:
+
+    python migraciones.py
+
+La versión aplicada se guarda en la tabla `schema_version`; al arrancar, la API
+solo comprueba esa versión con una consulta (ver `verificar_esquema`).
+Cada migración debe ser idempotente: las bases de datos anteriores al versionado
+ya tienen parte del esquema.
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+import logging
+import os
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database import Base
+from models import Gasto, RefreshToken, ResumenGasto, Usuario
+from resumenes import inicio_periodo, reconstruir_resumenes
+
+logger = logging.getLogger(__name__)
+
+# Aplicar las migraciones pendientes al arrancar en lugar de fallar (solo para desarrollo:
+# con varios workers cada uno intentaría migrar)
+DB_AUTO_MIGRAR = os.getenv("DB_AUTO_MIGRAR", "false").lower() in ("1", "true", "yes")
+
+# Fuera de Base.metadata: create_all nunca la toca
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("descripcion", String, nullable=False),
+    Column("aplicada", DateTime, nullable=False),
+)
+
+# Índices de una sola columna que ninguna consulta aprovecha y encarecen cada inserción;
+# ix_gastos_usuario_id queda cubierto por los compuestos, que empiezan por usuario_id,
+# e ix_gastos_id duplica la clave primaria
+INDICES_GASTOS_OBSOLETOS = [
+    "ix_gastos_id",
+    "ix_gastos_usuario_id",
+    "ix_gastos_descripcion",
+    "ix_gastos_monto",
+    "ix_gastos_categoria",
+    "ix_gastos_fecha",
+]
+
+
+class EsquemaDesactualizado(Exception):
+    """La base de datos no tiene la versión de esquema que espera el código"""
+
+
+def _esquema_inicial(conexion: Connection):
+    Base.metadata.create_all(conexion, tables=[Usuario.__table__, Gasto.__table__, RefreshToken.__table__])
+
+
+# Compuestos de la versión 2, sin el id que desempata la paginación por cursor
+INDICES_GASTOS_SIN_ID = [
+    "ix_gastos_usuario_fecha",
+    "ix_gastos_usuario_categoria_fecha",
+]
+
+
+def migrar_indices_gastos(conexion: Connection, obsoletos: List[str] = INDICES_GASTOS_OBSOLETOS):
+    """Crear los índices de `gastos` definidos en el modelo y eliminar los obsoletos"""
+    existentes = {indice["name"] for indice in inspect(conexion).get_indexes(Gasto.__tablename__)}
+    # Crear primero los nuevos: la consulta nunca se queda sin índice
+    for indice in Gasto.__table__.indexes:
+        if indice.name not in existentes:
+            indice.create(conexion)
+    for nombre in obsoletos:
+        if nombre in existentes:
+            conexion.execute(text(f"DROP INDEX {nombre}"))
+
+
+def _indices_gastos_con_id(conexion: Connection):
+    migrar_indices_gastos(conexion, INDICES_GASTOS_SIN_ID)
+
+
+def _resumen_gastos(conexion: Connection):
+    ResumenGasto.__table__.create(conexion, checkfirst=True)
+    reconstruir_resumenes(conexion)
+
+
+def _contador_presupuesto(conexion: Connection):
+    columnas = {columna["name"] for columna in inspect(conexion).get_columns(Usuario.__tablename__)}
+    if "gasto_periodo" not in columnas:
+        conexion.execute(text("ALTER TABLE usuarios ADD COLUMN gasto_periodo FLOAT NOT NULL DEFAULT 0"))
+    if "inicio_periodo" not in columnas:
+        conexion.execute(text("ALTER TABLE usuarios ADD COLUMN inicio_periodo DATE"))
+    # Arrancar cada contador con lo gastado en su periodo actual, desde el resumen de gastos
+    ahora = datetime.now()
+    usuarios = conexion.execute(
+        select(Usuario.id, Usuario.periodo_presupuesto).where(Usuario.periodo_presupuesto.is_not(None))
+    ).all()
+    for usuario_id, periodo in usuarios:
+        inicio = inicio_periodo(ahora, periodo)
+        total = conexion.scalar(
+            select(func.coalesce(func.sum(ResumenGasto.total), 0.0)).where(
+                ResumenGasto.usuario_id == usuario_id,
+                ResumenGasto.periodo == periodo,
+                ResumenGasto.inicio == inicio
+            )
+        )
+        conexion.execute(
+            update(Usuario).where(Usuario.id == usuario_id).values(gasto_periodo=total, inicio_periodo=inicio)
+        )
+
+
+# (versión, descripción, función); añadir siempre al final
+MIGRACIONES: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Tablas usuarios, gastos y refresh_tokens", _esquema_inicial),
+    (2, "Índices compuestos de gastos", migrar_indices_gastos),
+    (3, "Id en los índices compuestos de gastos", _indices_gastos_con_id),
+    (4, "Tabla resumen_gastos", _resumen_gastos),
+    (5, "Contador de gasto del periodo en usuarios", _contador_presupuesto),
+    (6, "Sin índice duplicado de la clave primaria de gastos", migrar_indices_gastos),
+]
+
+ESQUEMA_VERSION = MIGRACIONES[-1][0]
+
+
+def version_actual(conexion: Connection) -> int:
+    schema_version.create(conexion, checkfirst=True)
+    return conexion.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def migrar(engine: Engine) -> List[int]:
+    """Aplicar las migraciones pendientes, cada una en su transacción. Devuelve las versiones aplicadas"""
+    with engine.begin() as conexion:
+        actual = version_actual(conexion)
+    aplicadas = []
+    for version, descripcion, funcion in MIGRACIONES:
+        if version <= actual:
+            continue
+        with engine.begin() as conexion:
+            funcion(conexion)
+            conexion.execute(schema_version.insert().values(
+                version=version, descripcion=descripcion, aplicada=datetime.utcnow()
+            ))
+        logger.info(f"Migración {version} aplicada: {descripcion}")
+        aplicadas.append(version)
+    return aplicadas
+
+
+async def verificar_esquema(engine: AsyncEngine) -> int:
+    """
+    Comprobar al arrancar que la base de datos tiene la versión de esquema del código,
+    con una sola consulta. Lanza EsquemaDesactualizado si faltan migraciones.
+    """
+    try:
+        async with engine.connect() as conexion:
+            version = await conexion.scalar(select(func.max(schema_version.c.version))) or 0
+    except DBAPIError:
+        # Sin tabla schema_version: base de datos nueva o anterior al versionado
+        version = 0
+    if version < ESQUEMA_VERSION:
+        raise EsquemaDesactualizado(
+            f"Esquema en versión {version}, se necesita la {ESQUEMA_VERSION}: ejecuta `python migraciones.py`"
+        )
+    if version > ESQUEMA_VERSION:
+        logger.warning(f"Esquema en versión {version}, más reciente que la del código ({ESQUEMA_VERSION})")
+    return version
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    aplicadas = migrar(engine)
+    if aplicadas:
+        print(f"✅ Migraciones aplicadas: {aplicadas} (esquema en versión {ESQUEMA_VERSION})")
+    else:
+        print(f"✅ Esquema al día (versión {ESQUEMA_VERSION})")
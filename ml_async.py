@@ -0,0 +1,98 @@
+"""
+Cliente asíncrono para la API HTTP de Spaces de Gradio en Hugging Face
+"""
+from typing import Any, List, Optional
+import json
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Configuración del cliente asíncrono
+ML_MAX_CONCURRENCIA = int(os.getenv("ML_MAX_CONCURRENCIA", "8"))  # Predicciones remotas simultáneas por servicio
+# Predicciones simultáneas de un mismo lote: deja turnos libres para el resto de peticiones
+ML_LOTE_CONCURRENCIA = int(os.getenv("ML_LOTE_CONCURRENCIA", str(max(1, ML_MAX_CONCURRENCIA // 2))))
+ML_TIMEOUT_SECONDS = float(os.getenv("ML_TIMEOUT_SECONDS", "15"))  # Timeout HTTP de cada petición al Space
+
+# Prefijos de la API de Gradio: 5.x usa /gradio_api, 4.x la expone en la raíz
+PREFIJOS_API = ("/gradio_api", "")
+
+
+def url_space(model_space: str) -> str:
+    """Convertir 'usuario/Space' en la URL pública del Space ('https://usuario-space.hf.space')"""
+    subdominio = model_space.lower().replace("/", "-").replace("_", "-").replace(".", "-")
+    return f"https://{subdominio}.hf.space"
+
+
+class ErrorGradio(Exception):
+    """Error devuelto por el Space de Gradio"""
+
+
+class ClienteGradioAsync:
+    """
+    Cliente mínimo de la API `/call/<api_name>` de Gradio sobre una única
+    conexión HTTP reutilizada (httpx.AsyncClient con keep-alive)
+    """
+
+    def __init__(self, model_space: str, max_conexiones: int = ML_MAX_CONCURRENCIA, timeout: float = ML_TIMEOUT_SECONDS):
+        self.model_space = model_space
+        self.url_base = url_space(model_space)
+        self.max_conexiones = max_conexiones
+        self.timeout = timeout
+        self._http: Optional[httpx.AsyncClient] = None
+        self._prefijo: Optional[str] = None
+
+    def _cliente_http(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=self.url_base,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_conexiones,
+                    max_keepalive_connections=self.max_conexiones
+                ),
+                follow_redirects=True
+            )
+        return self._http
+
+    async def predecir(self, datos: List[Any], api_name: str = "/predict") -> Any:
+        """
+        Ejecutar una predicción y devolver la salida del modelo.
+        Con una sola salida se devuelve el valor directamente, igual que gradio_client.
+        """
+        http = self._cliente_http()
+        ruta = f"/call/{api_name.lstrip('/')}"
+
+        prefijos = (self._prefijo,) if self._prefijo is not None else PREFIJOS_API
+        respuesta = None
+        for prefijo in prefijos:
+            respuesta = await http.post(f"{prefijo}{ruta}", json={"data": datos})
+            if respuesta.status_code != 404:
+                self._prefijo = prefijo
+                break
+        respuesta.raise_for_status()
+        event_id = respuesta.json()["event_id"]
+
+        async with http.stream("GET", f"{self._prefijo}{ruta}/{event_id}") as stream:
+            stream.raise_for_status()
+            evento = None
+            async for linea in stream.aiter_lines():
+                if linea.startswith("event:"):
+                    evento = linea[len("event:"):].strip()
+                elif linea.startswith("data:"):
+                    contenido = linea[len("data:"):].strip()
+                    if evento == "complete":
+                        salida = json.loads(contenido)
+                        return salida[0] if isinstance(salida, list) and len(salida) == 1 else salida
+                    if evento == "error":
+                        raise ErrorGradio(contenido or f"Error en el Space {self.model_space}")
+
+        raise ErrorGradio(f"El Space {self.model_space} cerró la conexión sin resultado")
+
+    async def cerrar(self):
+        """Cerrar la conexión HTTP compartida"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
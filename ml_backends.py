@@ -0,0 +1,208 @@
+"""
+Backends de predicción intercambiables para los servicios de Machine Learning.
+
+- gradio: modelo remoto en un Space de Hugging Face (comportamiento original)
+- local: modelo exportado a archivos .npy que se cargan con memory mapping, de
+  modo que varios workers del mismo servidor comparten las mismas páginas de memoria
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional
+import logging
+import math
+import os
+import zlib
+
+import numpy as np
+
+from ml_async import ClienteGradioAsync
+from ml_local import extraer_rasgos
+from capibara_local import ModeloCapibaraLocal
+
+logger = logging.getLogger(__name__)
+
+# Selección de backend por servicio
+ML_BACKEND = os.getenv("ML_BACKEND", "gradio")
+ML_MODELO_PATH = os.getenv("ML_MODELO_PATH")  # Directorio con los .npy del modelo de categorías
+CAPIBARA_BACKEND = os.getenv("CAPIBARA_BACKEND", "gradio")
+
+
+def indice_rasgo(rasgo: str, n_rasgos: int) -> int:
+    """Posición de un rasgo en el vector de entrada (hashing estable entre procesos)"""
+    return zlib.crc32(rasgo.encode("utf-8")) % n_rasgos
+
+
+class BackendGradio:
+    """Modelo remoto en un Space de Gradio"""
+    nombre = "gradio"
+    remoto = True
+
+    def __init__(self, model_space: str):
+        self.model_space = model_space
+        self.cliente_async = ClienteGradioAsync(model_space)
+
+    def inicializar(self):
+        pass  # La conexión HTTP se abre con la primera predicción
+
+    async def predecir_async(self, **kwargs) -> Any:
+        # La API HTTP de Gradio recibe los parámetros por posición, en el orden de la función
+        return await self.cliente_async.predecir(list(kwargs.values()), api_name="/predict")
+
+    async def cerrar(self):
+        await self.cliente_async.cerrar()
+
+    def informacion(self) -> Dict[str, Any]:
+        return {"tipo": self.nombre, "modelo": self.model_space}
+
+
+class BackendLocal(ABC):
+    """Base de los modelos locales: se ejecutan en el proceso, sin red"""
+    nombre = "local"
+    remoto = False
+
+    def __init__(self, ruta: Optional[str]):
+        self.ruta = ruta
+
+    @abstractmethod
+    def inicializar(self):
+        """Cargar el modelo desde `ruta`"""
+
+    @abstractmethod
+    def predecir(self, **kwargs) -> Any:
+        """Predicción con el modelo cargado"""
+
+    async def predecir_async(self, **kwargs) -> Any:
+        return self.predecir(**kwargs)
+
+    async def cerrar(self):
+        pass
+
+    def informacion(self) -> Dict[str, Any]:
+        return {"tipo": self.nombre, "ruta": self.ruta}
+
+
+class BackendLocalCategorias(BackendLocal):
+    """
+    Clasificador lineal de categorías sobre rasgos de texto con hashing.
+    Archivos en el directorio `ruta`:
+
+    - `pesos.npy`: (n_rasgos, k), cargado con mmap
+    - `sesgo.npy`: (k,)
+    - `clases.npy`: (k,) etiquetas de las categorías
+
+    Devuelve el mismo formato que el Space ({"Categoría Sugerida": ...}) para que
+    `_interpretar_resultado` y `_calcular_confianza` funcionen sin cambios.
+    """
+
+    def inicializar(self):
+        if not self.ruta:
+            raise ValueError("ML_MODELO_PATH no configurado para el backend local")
+        self.pesos = np.load(os.path.join(self.ruta, "pesos.npy"), mmap_mode="r")
+        self.sesgo = np.load(os.path.join(self.ruta, "sesgo.npy"))
+        self.clases = np.load(os.path.join(self.ruta, "clases.npy"))
+        logger.info(f"Modelo local de categorías cargado desde {self.ruta} ({self.pesos.shape[0]} rasgos)")
+
+    def predecir(self, descripcion: str, **kwargs) -> Any:
+        n_rasgos = self.pesos.shape[0]
+        conteo: Dict[int, int] = {}
+        for rasgo in extraer_rasgos(descripcion):
+            indice = indice_rasgo(rasgo, n_rasgos)
+            conteo[indice] = conteo.get(indice, 0) + 1
+
+        logits = np.array(self.sesgo, dtype=np.float64)
+        if conteo:
+            indices = np.fromiter(conteo.keys(), dtype=np.int64)
+            valores = np.fromiter(conteo.values(), dtype=np.float64)
+            # Solo se leen las filas de los rasgos presentes
+            logits += valores @ self.pesos[indices]
+
+        probabilidades = np.exp(logits - logits.max())
+        probabilidades /= probabilidades.sum()
+        mejor = int(np.argmax(probabilidades))
+        return {
+            "Categoría Sugerida": str(self.clases[mejor]),
+            "probabilidad": round(float(probabilidades[mejor]), 4)
+        }
+
+
+class BackendLocalCapibara(BackendLocal):
+    """Modelo lineal de dificultad (ver ModeloCapibaraLocal), cargado con mmap si es un directorio"""
+
+    def inicializar(self):
+        self.modelo = ModeloCapibaraLocal.cargar(self.ruta)
+        if self.modelo is None:
+            raise ValueError("CAPIBARA_MODELO_PATH no configurado o ilegible para el backend local")
+
+    def predecir(self, bombs_hit: float, projectiles_hit: float, session_time: float) -> Any:
+        return self.modelo.predecir_lote([[bombs_hit, projectiles_hit, session_time]])[0]
+
+
+# Registro de backends: tipo de servicio -> nombre -> fábrica(model_space, ruta)
+REGISTRO_BACKENDS: Dict[str, Dict[str, Callable[[str, Optional[str]], Any]]] = {
+    "categorias": {
+        "gradio": lambda model_space, ruta: BackendGradio(model_space),
+        "local": lambda model_space, ruta: BackendLocalCategorias(ruta),
+    },
+    "capibara": {
+        "gradio": lambda model_space, ruta: BackendGradio(model_space),
+        "local": lambda model_space, ruta: BackendLocalCapibara(ruta),
+    },
+}
+
+
+def registrar_backend(tipo: str, nombre: str, fabrica: Callable[[str, Optional[str]], Any]):
+    """Añadir (o reemplazar) un backend para un tipo de servicio"""
+    REGISTRO_BACKENDS.setdefault(tipo, {})[nombre] = fabrica
+
+
+def crear_backend(tipo: str, nombre: str, model_space: str, ruta: Optional[str] = None):
+    """Crear el backend configurado; si el nombre no existe se usa Gradio"""
+    fabricas = REGISTRO_BACKENDS[tipo]
+    if nombre not in fabricas:
+        logger.warning(f"Backend '{nombre}' desconocido para {tipo}, se usa 'gradio'")
+        nombre = "gradio"
+    return fabricas[nombre](model_space, ruta)
+
+
+def exportar_clasificador(clasificador, ruta: str, n_rasgos: int = 2 ** 18):
+    """
+    Exportar un ClasificadorLocal (Naive Bayes) como modelo lineal para BackendLocalCategorias.
+    Naive Bayes es lineal en espacio logarítmico: sesgo = log P(c) y pesos = log P(rasgo | c).
+    """
+    clases = sorted(clasificador.conteo_clases)
+    if not clases:
+        raise ValueError("El clasificador no tiene ejemplos para exportar")
+    total_ejemplos = clasificador.ejemplos
+    tam_vocabulario = max(len(clasificador.vocabulario), 1)
+
+    pesos = np.zeros((n_rasgos, len(clases)), dtype=np.float32)
+    sesgo = np.zeros(len(clases), dtype=np.float64)
+    for j, categoria in enumerate(clases):
+        denominador = clasificador.total_rasgos[categoria] + clasificador.alpha * tam_vocabulario
+        sesgo[j] = math.log(clasificador.conteo_clases[categoria] / total_ejemplos)
+        conteo_hash = np.zeros(n_rasgos, dtype=np.float64)
+        for rasgo, n in clasificador.rasgos_por_clase[categoria].items():
+            conteo_hash[indice_rasgo(rasgo, n_rasgos)] += n
+        pesos[:, j] = np.log((conteo_hash + clasificador.alpha) / denominador)
+
+    os.makedirs(ruta, exist_ok=True)
+    np.save(os.path.join(ruta, "pesos.npy"), pesos)
+    np.save(os.path.join(ruta, "sesgo.npy"), sesgo)
+    np.save(os.path.join(ruta, "clases.npy"), np.array(clases))
+    logger.info(f"Modelo de categorías exportado a {ruta}")
+
+
+if __name__ == "__main__":
+    # Uso: python ml_backends.py <directorio>  → entrena con la tabla gastos y exporta
+    import sys
+    from database import SessionLocal
+    from ml_local import ClasificadorLocal
+
+    logging.basicConfig(level=logging.INFO)
+    destino = sys.argv[1] if len(sys.argv) > 1 else (ML_MODELO_PATH or "modelo_categorias")
+    db = SessionLocal()
+    try:
+        clasificador = ClasificadorLocal(min_ejemplos=0)
+        clasificador.cargar_desde_db(db)
+        exportar_clasificador(clasificador, destino)
+    finally:
+        db.close()
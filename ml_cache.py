@@ -0,0 +1,242 @@
+"""
+Caché LRU con expiración (TTL) para resultados de los modelos de Machine Learning
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la caché de sugerencias
+ML_CACHE_MAX_ITEMS = int(os.getenv("ML_CACHE_MAX_ITEMS", "5000"))
+ML_CACHE_TTL_SECONDS = float(os.getenv("ML_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ML_CACHE_SQLITE_PATH = os.getenv("ML_CACHE_SQLITE_PATH")  # Opcional: persistencia en disco
+ML_CACHE_VOLCADO_SECONDS = float(os.getenv("ML_CACHE_VOLCADO_SECONDS", "5"))  # Escrituras en disco agrupadas
+
+# Configuración de la caché de predicciones Capibara (entradas cuantizadas)
+CAPIBARA_CACHE_MAX_ITEMS = int(os.getenv("CAPIBARA_CACHE_MAX_ITEMS", "10000"))
+CAPIBARA_CACHE_TTL_SECONDS = float(os.getenv("CAPIBARA_CACHE_TTL_SECONDS", str(24 * 3600)))
+CAPIBARA_RESOLUCION_IMPACTOS = float(os.getenv("CAPIBARA_RESOLUCION_IMPACTOS", "1"))  # bombs_hit y projectiles_hit
+CAPIBARA_RESOLUCION_TIEMPO = float(os.getenv("CAPIBARA_RESOLUCION_TIEMPO", "5"))  # session_time, en segundos
+
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Normalizar un texto para usarlo como clave de caché:
+    minúsculas, sin acentos, espacios colapsados y dígitos agrupados en '#'
+    """
+    if not texto:
+        return ""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"\d+", "#", texto)
+    return " ".join(texto.split())
+
+
+def clave_sesion_capibara(bombs_hit: float, projectiles_hit: float, session_time: float) -> str:
+    """
+    Clave de caché de una sesión Capibara: cada entrada se trunca al múltiplo
+    de su resolución inmediatamente inferior, así sesiones casi iguales comparten predicción
+    (con `round`, que redondea al par en los empates, las cubetas no tendrían todas el mismo ancho)
+    """
+    cubetas = (
+        math.floor(bombs_hit / CAPIBARA_RESOLUCION_IMPACTOS),
+        math.floor(projectiles_hit / CAPIBARA_RESOLUCION_IMPACTOS),
+        math.floor(session_time / CAPIBARA_RESOLUCION_TIEMPO)
+    )
+    return "|".join(str(c) for c in cubetas)
+
+
+class CacheLRU:
+    """
+    Caché en memoria con desalojo LRU, expiración por TTL y contadores de aciertos.
+    Opcionalmente respalda las entradas en un archivo SQLite para sobrevivir reinicios:
+    al crearse carga las entradas vigentes del archivo, y a partir de ahí solo se lee
+    de memoria. Las escrituras en disco se acumulan y un hilo las vuelca en una sola
+    transacción cada ML_CACHE_VOLCADO_SECONDS, así ninguna consulta espera al disco;
+    si el proceso muere sin apagarse se pierden como mucho las del último intervalo.
+    """
+
+    def __init__(self, max_items: int, ttl: float, ruta_sqlite: Optional[str] = None, tabla: str = "cache",
+                 intervalo_volcado: float = ML_CACHE_VOLCADO_SECONDS):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.ruta_sqlite = ruta_sqlite
+        self.tabla = tabla
+        self.intervalo_volcado = intervalo_volcado
+        self._datos: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conexion = None
+        self._pendientes: Dict[str, Optional[tuple]] = {}  # clave -> (valor, creado), o None para borrarla
+        self._vaciar_disco = False
+        self._lock_disco = threading.Lock()
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.volcados = 0
+
+        if ruta_sqlite:
+            self._inicializar_disco()
+
+    def _inicializar_disco(self):
+        """Abrir (o crear) el archivo SQLite de respaldo, purgar entradas vencidas y cargar el resto"""
+        try:
+            self._conexion = sqlite3.connect(self.ruta_sqlite, check_same_thread=False)
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.tabla} "
+                "(clave TEXT PRIMARY KEY, valor TEXT NOT NULL, creado REAL NOT NULL)"
+            )
+            self._conexion.execute(
+                f"DELETE FROM {self.tabla} WHERE creado < ?", (time.time() - self.ttl,)
+            )
+            self._conexion.commit()
+            filas = self._conexion.execute(
+                f"SELECT clave, valor, creado FROM {self.tabla} ORDER BY creado DESC LIMIT ?", (self.max_items,)
+            ).fetchall()
+            # De la más antigua a la más reciente, para conservar el orden LRU
+            for clave, valor, creado in reversed(filas):
+                self._datos[clave] = (json.loads(valor), creado)
+            logger.info(f"Caché '{self.tabla}' respaldada en {self.ruta_sqlite} ({len(filas)} entradas cargadas)")
+        except Exception as e:
+            logger.error(f"Error al abrir caché en disco: {str(e)}")
+            self._conexion = None
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Obtener un valor de la caché, o None si no existe o expiró"""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None:
+                valor, creado = entrada
+                if ahora - creado <= self.ttl:
+                    self._datos.move_to_end(clave)
+                    self.aciertos += 1
+                    return valor
+                del self._datos[clave]
+
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave: str, valor: Any):
+        """Guardar un valor en la caché (y en disco, en el próximo volcado, si está configurado)"""
+        creado = time.time()
+        with self._lock:
+            self._guardar_memoria(clave, valor, creado)
+        self._pendiente(clave, (valor, creado))
+
+    def eliminar(self, clave: str):
+        """Quitar una entrada de la caché (y del disco, en el próximo volcado, si está configurado)"""
+        with self._lock:
+            self._datos.pop(clave, None)
+        self._pendiente(clave, None)
+
+    def limpiar(self):
+        """Vaciar la caché en memoria y en disco"""
+        with self._lock:
+            self._datos.clear()
+            if self._conexion is not None:
+                self._pendientes.clear()
+                self._vaciar_disco = True
+        self.iniciar()
+
+    def volcar(self) -> int:
+        """Escribir en disco los cambios pendientes; devuelve cuántas claves se escribieron o borraron"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            vaciar, self._vaciar_disco = self._vaciar_disco, False
+        if self._conexion is None or (not pendientes and not vaciar):
+            return 0
+        with self._lock_disco:
+            try:
+                if vaciar:
+                    self._conexion.execute(f"DELETE FROM {self.tabla}")
+                self._conexion.executemany(
+                    f"DELETE FROM {self.tabla} WHERE clave = ?",
+                    [(clave,) for clave, entrada in pendientes.items() if entrada is None]
+                )
+                self._conexion.executemany(
+                    f"INSERT OR REPLACE INTO {self.tabla} (clave, valor, creado) VALUES (?, ?, ?)",
+                    [(clave, json.dumps(entrada[0], default=str), entrada[1])
+                     for clave, entrada in pendientes.items() if entrada is not None]
+                )
+                self._conexion.commit()
+            except Exception as e:
+                self._conexion.rollback()
+                logger.error(f"Error escribiendo caché en disco: {str(e)}")
+                # Devolver lo que no se escribió, sin pisar cambios más recientes
+                # (un limpiar() posterior ya los descarta)
+                with self._lock:
+                    if not self._vaciar_disco:
+                        self._vaciar_disco = vaciar
+                        for clave, entrada in pendientes.items():
+                            self._pendientes.setdefault(clave, entrada)
+                return 0
+        self.volcados += 1
+        return len(pendientes)
+
+    def _bucle_volcado(self):
+        while not self._parar.is_set():
+            self._despertar.wait(self.intervalo_volcado)
+            self._despertar.clear()
+            self.volcar()
+
+    def iniciar(self):
+        """Lanzar el hilo de volcado a disco, si hay disco y no está en marcha"""
+        if self._conexion is None or (self._hilo is not None and self._hilo.is_alive()):
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._parar.clear()
+                self._hilo = threading.Thread(target=self._bucle_volcado, name=f"cache-{self.tabla}", daemon=True)
+                self._hilo.start()
+
+    def detener(self):
+        """Detener el hilo de volcado y escribir lo que quede pendiente"""
+        self._parar.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=10)
+            self._hilo = None
+        self.volcar()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Contadores de uso de la caché"""
+        total = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._datos),
+            "max_items": self.max_items,
+            "ttl_segundos": self.ttl,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+            "tasa_aciertos": round(self.aciertos / total, 4) if total else 0.0,
+            "persistente": self._conexion is not None,
+            "pendientes_disco": len(self._pendientes),
+            "volcados": self.volcados
+        }
+
+    def _pendiente(self, clave: str, entrada: Optional[tuple]):
+        if self._conexion is None:
+            return
+        with self._lock:
+            self._pendientes[clave] = entrada
+        self.iniciar()
+
+    def _guardar_memoria(self, clave: str, valor: Any, creado: float):
+        self._datos[clave] = (valor, creado)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_items:
+            self._datos.popitem(last=False)
+            self.desalojos += 1
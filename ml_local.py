@@ -0,0 +1,117 @@
+"""
+Clasificador local incremental (Naive Bayes multinomial) para categorías de gastos
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import logging
+import math
+import os
+import threading
+
+from ml_cache import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+# Configuración del clasificador local
+ML_LOCAL_UMBRAL = float(os.getenv("ML_LOCAL_UMBRAL", "0.9"))  # Confianza mínima para responder sin el modelo remoto
+ML_LOCAL_MIN_EJEMPLOS = int(os.getenv("ML_LOCAL_MIN_EJEMPLOS", "30"))  # Ejemplos necesarios antes de predecir
+ML_LOCAL_ALPHA = float(os.getenv("ML_LOCAL_ALPHA", "1.0"))  # Suavizado de Laplace
+
+
+def extraer_rasgos(descripcion: str) -> List[str]:
+    """Palabras y n-gramas de caracteres (3 y 4) de la descripción normalizada"""
+    texto = normalizar_texto(descripcion)
+    rasgos = [f"w:{palabra}" for palabra in texto.split()]
+    relleno = f" {texto} "
+    for n in (3, 4):
+        rasgos.extend(f"c:{relleno[i:i + n]}" for i in range(len(relleno) - n + 1))
+    return rasgos
+
+
+class ClasificadorLocal:
+    """
+    Naive Bayes multinomial que se entrena de forma incremental con los gastos
+    guardados (descripción → categoría final)
+    """
+
+    def __init__(self, alpha: float = ML_LOCAL_ALPHA, min_ejemplos: int = ML_LOCAL_MIN_EJEMPLOS):
+        self.alpha = alpha
+        self.min_ejemplos = min_ejemplos
+        self.conteo_clases: Counter = Counter()
+        self.rasgos_por_clase: Dict[str, Counter] = {}
+        self.total_rasgos: Counter = Counter()
+        self.vocabulario = set()
+        self._lock = threading.Lock()
+
+    @property
+    def ejemplos(self) -> int:
+        return sum(self.conteo_clases.values())
+
+    def entrenar(self, descripcion: str, categoria: str, veces: int = 1):
+        """Actualizar el modelo con un ejemplo etiquetado (repetido `veces` veces)"""
+        rasgos = extraer_rasgos(descripcion)
+        if not rasgos:
+            return
+        categoria = categoria.lower().strip()
+        with self._lock:
+            self.conteo_clases[categoria] += veces
+            conteo = self.rasgos_por_clase.setdefault(categoria, Counter())
+            for rasgo in rasgos:
+                conteo[rasgo] += veces
+            self.total_rasgos[categoria] += len(rasgos) * veces
+            self.vocabulario.update(rasgos)
+
+    def predecir(self, descripcion: str) -> Optional[Tuple[str, float]]:
+        """
+        Predecir la categoría de una descripción.
+
+        Returns:
+            Tupla (categoría, probabilidad) o None si el modelo aún no tiene
+            suficientes ejemplos o no reconoce ningún rasgo de la descripción
+        """
+        with self._lock:
+            total_ejemplos = self.ejemplos
+            if total_ejemplos < self.min_ejemplos or len(self.conteo_clases) < 2:
+                return None
+
+            rasgos = Counter(r for r in extraer_rasgos(descripcion) if r in self.vocabulario)
+            if not rasgos:
+                return None
+
+            tam_vocabulario = len(self.vocabulario)
+            log_probabilidades = {}
+            for categoria, n_clase in self.conteo_clases.items():
+                conteo = self.rasgos_por_clase[categoria]
+                denominador = math.log(self.total_rasgos[categoria] + self.alpha * tam_vocabulario)
+                log_p = math.log(n_clase / total_ejemplos)
+                for rasgo, n in rasgos.items():
+                    log_p += n * (math.log(conteo[rasgo] + self.alpha) - denominador)
+                log_probabilidades[categoria] = log_p
+
+        # Normalizar en espacio logarítmico para obtener probabilidades
+        maximo = max(log_probabilidades.values())
+        exponenciales = {c: math.exp(lp - maximo) for c, lp in log_probabilidades.items()}
+        suma = sum(exponenciales.values())
+        mejor = max(exponenciales, key=exponenciales.get)
+        return mejor, exponenciales[mejor] / suma
+
+    def cargar_desde_db(self, db) -> int:
+        """Entrenar el modelo con todos los gastos guardados en la base de datos"""
+        from models import Gasto
+
+        cargados = 0
+        for descripcion, categoria in db.query(Gasto.descripcion, Gasto.categoria).yield_per(1000):
+            if descripcion and categoria:
+                self.entrenar(descripcion, categoria.value)
+                cargados += 1
+        logger.info(f"Clasificador local entrenado con {cargados} gastos")
+        return cargados
+
+    def estadisticas(self) -> Dict[str, object]:
+        """Resumen del estado del modelo"""
+        return {
+            "ejemplos": self.ejemplos,
+            "clases": dict(self.conteo_clases),
+            "vocabulario": len(self.vocabulario),
+            "listo": self.ejemplos >= self.min_ejemplos and len(self.conteo_clases) >= 2
+        }
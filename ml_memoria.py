@@ -0,0 +1,90 @@
+"""
+Memoria por usuario de descripción → categoría final, aprendida de sus propios gastos
+"""
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+import logging
+import os
+import threading
+
+from ml_cache import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la memoria por usuario
+ML_MEMORIA_UMBRAL = float(os.getenv("ML_MEMORIA_UMBRAL", "0.9"))  # Proporción mínima de la categoría dominante
+ML_MEMORIA_MIN_REPETICIONES = int(os.getenv("ML_MEMORIA_MIN_REPETICIONES", "2"))  # Gastos mínimos con esa descripción
+
+
+class MemoriaUsuarios:
+    """
+    Índice en memoria por usuario: descripción normalizada → {categoría: [veces, última fecha]}.
+    Permite responder al instante cuando el historial del propio usuario no deja dudas.
+    """
+
+    def __init__(self, umbral: float = ML_MEMORIA_UMBRAL, min_repeticiones: int = ML_MEMORIA_MIN_REPETICIONES):
+        self.umbral = umbral
+        self.min_repeticiones = min_repeticiones
+        self._indice: Dict[int, Dict[str, Dict[str, list]]] = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.consultas = 0
+
+    def registrar(self, usuario_id: int, descripcion: str, categoria: str, fecha: Optional[datetime] = None,
+                  veces: int = 1):
+        """Sumar `veces` gastos del usuario con la misma descripción y categoría final"""
+        clave = normalizar_texto(descripcion)
+        if not clave:
+            return
+        fecha = fecha or datetime.utcnow()
+        with self._lock:
+            categorias = self._indice.setdefault(usuario_id, {}).setdefault(clave, {})
+            entrada = categorias.setdefault(categoria.lower().strip(), [0, fecha])
+            entrada[0] += veces
+            entrada[1] = max(entrada[1], fecha)
+
+    def olvidar(self, usuario_id: int, descripcion: str, categoria: str):
+        """Restar un gasto (al editarlo o eliminarlo)"""
+        clave = normalizar_texto(descripcion)
+        categoria = categoria.lower().strip()
+        with self._lock:
+            categorias = self._indice.get(usuario_id, {}).get(clave)
+            if not categorias or categoria not in categorias:
+                return
+            categorias[categoria][0] -= 1
+            if categorias[categoria][0] <= 0:
+                del categorias[categoria]
+            if not categorias:
+                del self._indice[usuario_id][clave]
+
+    def consultar(self, usuario_id: int, descripcion: str) -> Optional[Tuple[str, float, int]]:
+        """
+        Categoría que el usuario usa para esta descripción, si es inequívoca.
+
+        Returns:
+            Tupla (categoría, proporción, veces) o None si no hay historial suficiente
+            o el usuario ha usado varias categorías para la misma descripción
+        """
+        clave = normalizar_texto(descripcion)
+        with self._lock:
+            self.consultas += 1
+            categorias = self._indice.get(usuario_id, {}).get(clave)
+            if not categorias:
+                return None
+            total = sum(veces for veces, _ in categorias.values())
+            # La más usada; a igualdad de veces, la más reciente
+            categoria, (veces, _) = max(categorias.items(), key=lambda item: (item[1][0], item[1][1]))
+            proporcion = veces / total
+            if veces < self.min_repeticiones or proporcion < self.umbral:
+                return None
+            self.aciertos += 1
+            return categoria, proporcion, veces
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "usuarios": len(self._indice),
+            "descripciones": sum(len(d) for d in self._indice.values()),
+            "consultas": self.consultas,
+            "aciertos": self.aciertos,
+            "tasa_aciertos": round(self.aciertos / self.consultas, 4) if self.consultas else 0.0
+        }
@@ -0,0 +1,110 @@
+"""
+Interruptor de circuito (circuit breaker) y límites de tiempo para las predicciones remotas
+"""
+from typing import Any, Dict, Optional
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Configuración de resiliencia
+ML_DEADLINE_SECONDS = float(os.getenv("ML_DEADLINE_SECONDS", "5"))  # Tiempo máximo de espera por predicción
+ML_CIRCUITO_UMBRAL_FALLOS = int(os.getenv("ML_CIRCUITO_UMBRAL_FALLOS", "5"))  # Fallos seguidos para abrir el circuito
+ML_CIRCUITO_ENFRIAMIENTO_SECONDS = float(os.getenv("ML_CIRCUITO_ENFRIAMIENTO_SECONDS", "30"))  # Tiempo abierto antes de probar
+
+# Estados del circuito
+CIRCUITO_CERRADO = "cerrado"
+CIRCUITO_ABIERTO = "abierto"
+CIRCUITO_SEMIABIERTO = "semiabierto"
+
+
+class CircuitoAbierto(Exception):
+    """El circuito está abierto: no se intenta la llamada remota"""
+
+
+class InterruptorCircuito:
+    """
+    Interruptor de circuito para un servicio remoto.
+
+    - cerrado: las llamadas pasan; tras `umbral_fallos` fallos seguidos se abre.
+    - abierto: las llamadas se rechazan al instante durante `enfriamiento` segundos.
+    - semiabierto: se deja pasar una única llamada de prueba; si funciona se cierra,
+      si falla se vuelve a abrir.
+    """
+
+    def __init__(self, nombre: str, umbral_fallos: int = ML_CIRCUITO_UMBRAL_FALLOS,
+                 enfriamiento: float = ML_CIRCUITO_ENFRIAMIENTO_SECONDS):
+        self.nombre = nombre
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.estado = CIRCUITO_CERRADO
+        self.fallos_consecutivos = 0
+        self.aperturas = 0
+        self.rechazadas = 0
+        self.ultimo_fallo: Optional[float] = None
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        """Indicar si se puede intentar una llamada remota ahora"""
+        with self._lock:
+            if self.estado == CIRCUITO_CERRADO:
+                return True
+            if self.estado == CIRCUITO_ABIERTO and time.monotonic() - self._abierto_desde >= self.enfriamiento:
+                self.estado = CIRCUITO_SEMIABIERTO
+                self._prueba_en_curso = False
+                logger.info(f"Circuito {self.nombre} semiabierto: se permite una llamada de prueba")
+            if self.estado == CIRCUITO_SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            self.rechazadas += 1
+            return False
+
+    def verificar(self):
+        """Como `permitir`, pero lanza CircuitoAbierto si la llamada no está permitida"""
+        if not self.permitir():
+            raise CircuitoAbierto(f"Servicio {self.nombre} suspendido temporalmente tras fallos repetidos")
+
+    def registrar_exito(self):
+        with self._lock:
+            if self.estado != CIRCUITO_CERRADO:
+                logger.info(f"Circuito {self.nombre} cerrado: el servicio respondió")
+            self.estado = CIRCUITO_CERRADO
+            self.fallos_consecutivos = 0
+            self._prueba_en_curso = False
+
+    def liberar_prueba(self):
+        """La llamada permitida no llegó a probar el servicio (cancelada o sin tiempo): ni éxito ni fallo"""
+        with self._lock:
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos_consecutivos += 1
+            self.ultimo_fallo = time.time()
+            if self.estado == CIRCUITO_SEMIABIERTO or (
+                self.estado == CIRCUITO_CERRADO and self.fallos_consecutivos >= self.umbral_fallos
+            ):
+                self.estado = CIRCUITO_ABIERTO
+                self._abierto_desde = time.monotonic()
+                self._prueba_en_curso = False
+                self.aperturas += 1
+                logger.warning(
+                    f"Circuito {self.nombre} abierto tras {self.fallos_consecutivos} fallos; "
+                    f"nueva prueba en {self.enfriamiento:.0f}s"
+                )
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Estado y contadores del circuito"""
+        return {
+            "estado": self.estado,
+            "fallos_consecutivos": self.fallos_consecutivos,
+            "umbral_fallos": self.umbral_fallos,
+            "enfriamiento_segundos": self.enfriamiento,
+            "aperturas": self.aperturas,
+            "rechazadas": self.rechazadas,
+            "ultimo_fallo": self.ultimo_fallo
+        }
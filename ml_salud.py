@@ -0,0 +1,98 @@
+"""
+Monitor de salud en segundo plano para los modelos remotos de Machine Learning
+"""
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+import time
+
+from metricas import percentiles_ms
+
+logger = logging.getLogger(__name__)
+
+# Configuración del monitor
+ML_SALUD_INTERVALO_SECONDS = float(os.getenv("ML_SALUD_INTERVALO_SECONDS", "60"))  # Tiempo entre sondas
+ML_SALUD_VENTANA = int(os.getenv("ML_SALUD_VENTANA", "100"))  # Latencias guardadas para los percentiles
+
+
+class SaludServicio:
+    """Resultados de las sondas de un servicio: latencias recientes y últimos éxitos/fallos"""
+
+    def __init__(self, ventana: int = ML_SALUD_VENTANA):
+        self.latencias = deque(maxlen=ventana)
+        self.sondas = 0
+        self.fallos = 0
+        self.disponible: Optional[bool] = None  # None hasta la primera sonda
+        self.ultimo_exito: Optional[datetime] = None
+        self.ultimo_fallo: Optional[datetime] = None
+        self.ultimo_error: Optional[str] = None
+
+    def registrar(self, exito: bool, latencia: float, error: Optional[str] = None):
+        self.sondas += 1
+        self.disponible = exito
+        if exito:
+            self.latencias.append(latencia)
+            self.ultimo_exito = datetime.utcnow()
+        else:
+            self.fallos += 1
+            self.ultimo_fallo = datetime.utcnow()
+            self.ultimo_error = error
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            "disponible": self.disponible,
+            "sondas": self.sondas,
+            "fallos": self.fallos,
+            "latencia_ms": percentiles_ms(self.latencias),
+            "ultimo_exito": self.ultimo_exito.isoformat() if self.ultimo_exito else None,
+            "ultimo_fallo": self.ultimo_fallo.isoformat() if self.ultimo_fallo else None,
+            "ultimo_error": self.ultimo_error
+        }
+
+
+class MonitorSalud:
+    """
+    Sondea periódicamente cada servicio (con `servicio.sondear()`) y guarda una
+    instantánea de su salud, para que /ml/estado responda sin llamar al modelo.
+    """
+
+    def __init__(self, servicios: List[Any], intervalo: float = ML_SALUD_INTERVALO_SECONDS):
+        self.servicios = servicios
+        self.intervalo = intervalo
+        self.salud = {servicio.nombre: SaludServicio() for servicio in servicios}
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def sondear(self, servicio):
+        """Ejecutar una sonda sobre un servicio y registrar el resultado"""
+        inicio = time.perf_counter()
+        try:
+            await servicio.sondear()
+            self.salud[servicio.nombre].registrar(True, time.perf_counter() - inicio)
+        except Exception as e:
+            self.salud[servicio.nombre].registrar(False, time.perf_counter() - inicio, error=str(e))
+
+    async def _bucle(self):
+        while True:
+            await asyncio.gather(*(self.sondear(servicio) for servicio in self.servicios))
+            await asyncio.sleep(self.intervalo)
+
+    def iniciar(self):
+        """Lanzar el bucle de sondas en el event loop actual"""
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    def instantanea(self, nombre: str) -> Dict[str, Any]:
+        """Último estado conocido de un servicio"""
+        return {**self.salud[nombre].resumen(), "intervalo_segundos": self.intervalo}
@@ -1,75 +1,406 @@
-from gradio_client import Client
-from typing import Dict, Any, Optional
+from collections import Counter
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Any, Iterable, List, Optional, Tuple
+import asyncio
 import logging
+import math
+import threading
+import time
 from models import CategoriaGasto
+from ml_cache import (
+    CacheLRU, normalizar_texto, clave_sesion_capibara,
+    ML_CACHE_MAX_ITEMS, ML_CACHE_TTL_SECONDS, ML_CACHE_SQLITE_PATH,
+    CAPIBARA_CACHE_MAX_ITEMS, CAPIBARA_CACHE_TTL_SECONDS
+)
+from ml_local import ClasificadorLocal, ML_LOCAL_UMBRAL
+from ml_memoria import MemoriaUsuarios
+from ml_async import ML_MAX_CONCURRENCIA, ML_LOTE_CONCURRENCIA
+from ml_backends import crear_backend, ML_BACKEND, ML_MODELO_PATH, CAPIBARA_BACKEND
+from ml_resiliencia import InterruptorCircuito, ML_DEADLINE_SECONDS
+from ml_salud import MonitorSalud
+from capibara_local import ModeloCapibaraLocal, CAPIBARA_MODELO_PATH
+from schemas import LOTE_MAX_ELEMENTOS
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class MLService:
-    """Servicio para interactuar con el modelo de Machine Learning en Hugging Face"""
+# Estados del backend de predicción
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_INICIALIZANDO = "inicializando"
+ESTADO_LISTO = "listo"
+ESTADO_FALLIDO = "fallido"
+
+class VueloUnico:
+    """
+    Agrupa llamadas idénticas concurrentes: mientras una llamada con cierta clave
+    está en curso, las demás con la misma clave esperan su resultado en vez de
+    repetirla. Si la llamada falla, todas reciben la misma excepción.
+    """
     
     def __init__(self):
-        self.client = None
-        self.model_space = "cristiandiaz2403/MiSpace"
-        self._initialize_client()
+        self._en_curso_async: Dict[str, asyncio.Task] = {}
+        self.llamadas = 0
+        self.ahorradas = 0
+    
+    async def ejecutar_async(self, clave: str, funcion: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecutar `funcion` o esperar a la que ya está en curso con la misma clave.
+        La llamada corre en una tarea compartida, así la cancelación de quien la
+        inició no cancela la espera de los demás
+        """
+        tarea = self._en_curso_async.get(clave)
+        if tarea is not None:
+            self.ahorradas += 1
+        else:
+            tarea = asyncio.ensure_future(funcion())
+            self._en_curso_async[clave] = tarea
+            self.llamadas += 1
+            tarea.add_done_callback(lambda _: self._en_curso_async.pop(clave, None))
+        return await asyncio.shield(tarea)
+    
+    def estadisticas(self) -> Dict[str, Any]:
+        total = self.llamadas + self.ahorradas
+        return {
+            "llamadas": self.llamadas,
+            "ahorradas": self.ahorradas,
+            "en_curso": len(self._en_curso_async),
+            "tasa_ahorro": round(self.ahorradas / total, 4) if total else 0.0
+        }
+
+class ServicioRemoto:
+    """
+    Base para los servicios de predicción, con backend en un Space de Gradio o
+    modelo local (ver ml_backends). Las llamadas a backends remotos pasan
+    por un interruptor de circuito y tienen un tiempo máximo.
+    """
+    nombre = "ML"
+    tipo_backend = "categorias"
+    datos_sonda: Dict[str, Any] = {}  # Entrada de prueba para el monitor de salud
+    
+    def __init__(self, model_space: str, backend: str = "gradio", ruta_modelo: Optional[str] = None):
+        self.model_space = model_space
+        self.backend = crear_backend(self.tipo_backend, backend, model_space, ruta_modelo)
+        self.estado_cliente = ESTADO_PENDIENTE
+        self.tiempo_inicializacion: Optional[float] = None
+        self.error_inicializacion: Optional[str] = None
+        self._lock_inicializacion = threading.Lock()
+        self._semaforo = asyncio.Semaphore(ML_MAX_CONCURRENCIA)
+        self.interruptor = InterruptorCircuito(self.nombre)
+    
+    @property
+    def listo(self) -> bool:
+        return self.estado_cliente == ESTADO_LISTO
+    
+    def inicializar(self):
+        """
+        Inicializar el backend. Un modelo local abre sus archivos con mmap; el remoto
+        no necesita conectar por adelantado: su cliente HTTP se abre con la primera predicción.
+        Los fallos de inicialización no cuentan para el circuito, que solo mide las predicciones.
+        """
+        with self._lock_inicializacion:
+            if self.estado_cliente in (ESTADO_INICIALIZANDO, ESTADO_LISTO):
+                return
+            self.estado_cliente = ESTADO_INICIALIZANDO
+            
+            inicio = time.perf_counter()
+            try:
+                self.backend.inicializar()
+                self.error_inicializacion = None
+                self.estado_cliente = ESTADO_LISTO
+                logger.info(f"Cliente {self.nombre} inicializado correctamente ({self.backend.nombre}) para {self.model_space}")
+            except Exception as e:
+                logger.error(f"Error al inicializar cliente {self.nombre}: {str(e)}")
+                self.error_inicializacion = str(e)
+                self.estado_cliente = ESTADO_FALLIDO
+            finally:
+                self.tiempo_inicializacion = time.perf_counter() - inicio
+                logger.info(f"Inicialización del cliente {self.nombre}: {self.tiempo_inicializacion:.2f}s")
     
-    def _initialize_client(self):
-        """Inicializar el cliente de Gradio"""
+    def estado_inicializacion(self) -> Dict[str, Any]:
+        """Estado del backend, consultable sin bloquear"""
+        return {
+            "estado": self.estado_cliente,
+            "tiempo_inicializacion": round(self.tiempo_inicializacion, 3) if self.tiempo_inicializacion is not None else None,
+            "error": self.error_inicializacion
+        }
+    
+    def estado_servicio(self) -> Dict[str, Any]:
+        """Estado del backend y del circuito, consultable sin bloquear"""
+        return {
+            "backend": self.backend.informacion(),
+            "inicializacion": self.estado_inicializacion(),
+            "circuito": self.interruptor.estadisticas()
+        }
+    
+    async def _predecir_remoto_async(self, deadline: Optional[float] = None, **kwargs) -> Any:
+        """
+        Predicción asíncrona con el backend. Si es remoto, está protegida por el circuito
+        y limitada por el semáforo de concurrencia. El deadline es el tiempo total, cola incluida;
+        agotarlo esperando turno (o con poco tiempo restante para el modelo) no es un fallo
+        del servicio remoto y no abre el circuito.
+        Los parámetros se pasan en el orden de la función del modelo.
+        """
+        if not self.backend.remoto:
+            if not self.listo:
+                raise RuntimeError(f"Modelo local {self.nombre} no disponible ({self.estado_cliente})")
+            return await self.backend.predecir_async(**kwargs)
+        
+        deadline = deadline or ML_DEADLINE_SECONDS
+        bucle = asyncio.get_running_loop()
+        limite = bucle.time() + deadline
         try:
-            self.client = Client(self.model_space)
-            logger.info(f"Cliente ML inicializado correctamente para {self.model_space}")
-        except Exception as e:
-            logger.error(f"Error al inicializar cliente ML: {str(e)}")
-            self.client = None
+            await asyncio.wait_for(self._semaforo.acquire(), timeout=deadline)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Sin turno para predecir con {self.nombre} tras {deadline}s en cola")
+        try:
+            # Tras la espera: el circuito pudo abrirse mientras la llamada estaba en cola
+            self.interruptor.verificar()
+            restante = limite - bucle.time()
+            try:
+                result = await asyncio.wait_for(self.backend.predecir_async(**kwargs), timeout=restante)
+            except asyncio.TimeoutError:
+                # Con menos de medio deadline tras la cola, agotarlo no dice nada del servicio remoto
+                if restante >= deadline / 2:
+                    self.interruptor.registrar_fallo()
+                else:
+                    self.interruptor.liberar_prueba()
+                raise TimeoutError(f"Tiempo de espera agotado ({deadline}s)")
+            except asyncio.CancelledError:
+                self.interruptor.liberar_prueba()
+                raise
+            except Exception:
+                self.interruptor.registrar_fallo()
+                raise
+        finally:
+            self._semaforo.release()
+        self.interruptor.registrar_exito()
+        return result
     
-    def obtener_sugerencia_categoria(self, descripcion: str, categoria_usuario: str) -> Dict[str, Any]:
+    @staticmethod
+    async def _en_paralelo(llamadas: List[Callable[[], Awaitable[Any]]], limite: int = ML_LOTE_CONCURRENCIA) -> List[Any]:
         """
-        Obtener sugerencia de categoría del modelo ML
+        Ejecutar las llamadas de un lote con como mucho `limite` a la vez, en el orden
+        recibido; las excepciones se devuelven en su posición en lugar de lanzarse
+        """
+        semaforo = asyncio.Semaphore(limite)
         
-        Args:
-            descripcion: Descripción del gasto
-            categoria_usuario: Categoría elegida por el usuario
-            
-        Returns:
-            Diccionario con la respuesta del modelo y metadatos
+        async def limitada(llamada):
+            async with semaforo:
+                return await llamada()
+        
+        return await asyncio.gather(*(limitada(llamada) for llamada in llamadas), return_exceptions=True)
+    
+    async def sondear(self) -> Any:
+        """Predicción de prueba contra el backend, usada por el monitor de salud"""
+        return await self._predecir_remoto_async(**self.datos_sonda)
+    
+    async def cerrar(self):
+        """Liberar las conexiones del backend"""
+        await self.backend.cerrar()
+
+class MLService(ServicioRemoto):
+    """Servicio para interactuar con el modelo de Machine Learning en Hugging Face"""
+    datos_sonda = {"descripcion": "test comida hamburguesa", "categoria_usuario": "comida"}
+    
+    def __init__(self):
+        super().__init__("cristiandiaz2403/MiSpace", backend=ML_BACKEND, ruta_modelo=ML_MODELO_PATH)
+        self.cache = CacheLRU(
+            max_items=ML_CACHE_MAX_ITEMS,
+            ttl=ML_CACHE_TTL_SECONDS,
+            ruta_sqlite=ML_CACHE_SQLITE_PATH,
+            tabla="sugerencias_categoria"
+        )
+        self.clasificador = ClasificadorLocal()
+        self.umbral_local = ML_LOCAL_UMBRAL
+        self.memoria = MemoriaUsuarios()
+        self.vuelo_unico = VueloUnico()
+    
+    async def obtener_sugerencia_categoria_async(self, descripcion: str, categoria_usuario: str, usar_cache: bool = True, usar_local: bool = True, deadline: Optional[float] = None, usuario_id: Optional[int] = None) -> Dict[str, Any]:
         """
-        if not self.client:
-            logger.warning("Cliente ML no disponible, reintentar inicialización")
-            self._initialize_client()
-            
-        if not self.client:
-            return self._respuesta_fallback(descripcion, categoria_usuario)
+        Obtener sugerencia de categoría del modelo ML.
+        La llamada remota usa una conexión HTTP compartida, limitada por un semáforo
+        de concurrencia y con tiempo máximo por predicción; no ocupa hilos del servidor.
+        
+        """
+        categoria_usuario_normalizada = self._normalizar_categoria(categoria_usuario)
+        clave_cache = self._clave_cache(descripcion, categoria_usuario_normalizada)
+        
+        de_memoria = self._respuesta_memoria(usuario_id, descripcion, categoria_usuario_normalizada)
+        if de_memoria is not None:
+            return de_memoria
+        
+        en_cache = self._respuesta_cache(descripcion, clave_cache) if usar_cache else None
+        if en_cache is not None:
+            return en_cache
+        
+        prediccion_local = self.clasificador.predecir(descripcion) if usar_local else None
+        if prediccion_local and prediccion_local[1] >= self.umbral_local:
+            return self._respuesta_local(descripcion, categoria_usuario_normalizada, *prediccion_local)
         
         try:
-            # Validar que la categoría del usuario sea válida
-            categorias_validas = ['comida', 'transporte', 'varios']
-            categoria_usuario_normalizada = categoria_usuario.lower().strip()
-            if categoria_usuario_normalizada not in categorias_validas:
-                categoria_usuario_normalizada = 'varios'  # Categoría por defecto
-            
-            # Llamar al modelo
-            result = self.client.predict(
+            result = await self.vuelo_unico.ejecutar_async(clave_cache, lambda: self._predecir_remoto_async(
+                deadline=deadline,
                 descripcion=descripcion,
-                categoria_usuario=categoria_usuario_normalizada,
-                api_name="/predict"
-            )
-            
-            logger.info(f"Predicción exitosa para descripción: '{descripcion[:50]}...'")
-            
-            return {
-                "exito": True,
-                "prediccion_modelo": result,
-                "categoria_original": categoria_usuario_normalizada,
-                "descripcion": descripcion,
-                "recomendacion": self._interpretar_resultado(result, categoria_usuario_normalizada),
-                "confianza": self._calcular_confianza(result, categoria_usuario_normalizada)
-            }
+                categoria_usuario=categoria_usuario_normalizada
+            ))
+            return self._respuesta_modelo(descripcion, categoria_usuario_normalizada, clave_cache, result)
             
         except Exception as e:
-            logger.error(f"Error en predicción ML: {str(e)}")
-            return self._respuesta_fallback(descripcion, categoria_usuario, error=str(e))
+            logger.error(f"Error en predicción ML asíncrona: {str(e)}")
+            return self._respuesta_sin_modelo(descripcion, categoria_usuario_normalizada, prediccion_local, error=str(e))
+    
+    async def obtener_sugerencias_lote_async(self, items: List[Tuple[str, str]], usuario_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Obtener sugerencias para una lista de (descripción, categoría) en el mismo orden.
+        Los pares repetidos se consultan una sola vez y el resto se lanzan en paralelo,
+        como mucho ML_LOTE_CONCURRENCIA a la vez, para que un lote no ocupe todos los turnos
+        del modelo remoto. Un error en un elemento solo afecta a ese elemento.
+        """
+        claves = [self._clave_cache(descripcion, self._normalizar_categoria(categoria)) for descripcion, categoria in items]
+        
+        unicos: Dict[str, Tuple[str, str]] = {}
+        for clave, item in zip(claves, items):
+            unicos.setdefault(clave, item)
+        
+        resultados = await self._en_paralelo([
+            lambda descripcion=descripcion, categoria=categoria: self.obtener_sugerencia_categoria_async(
+                descripcion, categoria, usuario_id=usuario_id
+            )
+            for descripcion, categoria in unicos.values()
+        ])
+        
+        por_clave = {}
+        for (clave, (descripcion, categoria)), resultado in zip(unicos.items(), resultados):
+            if isinstance(resultado, Exception):
+                logger.error(f"Error en predicción ML del lote: {str(resultado)}")
+                resultado = self._respuesta_fallback(descripcion, categoria, error=str(resultado))
+            por_clave[clave] = resultado
+        
+        return [{**por_clave[clave], "descripcion": descripcion} for clave, (descripcion, _) in zip(claves, items)]
+    
+    def _normalizar_categoria(self, categoria_usuario: str) -> str:
+        """Validar que la categoría del usuario sea válida"""
+        categorias_validas = ['comida', 'transporte', 'varios']
+        categoria_usuario_normalizada = categoria_usuario.lower().strip()
+        if categoria_usuario_normalizada not in categorias_validas:
+            categoria_usuario_normalizada = 'varios'  # Categoría por defecto
+        return categoria_usuario_normalizada
+    
+    def _respuesta_memoria(self, usuario_id: Optional[int], descripcion: str, categoria_original: str) -> Optional[Dict[str, Any]]:
+        """Respuesta a partir del historial del usuario, si es inequívoco"""
+        if usuario_id is None:
+            return None
+        recordada = self.memoria.consultar(usuario_id, descripcion)
+        if recordada is None:
+            return None
+        categoria, proporcion, veces = recordada
+        return {
+            "exito": True,
+            "prediccion_modelo": {"Categoría Sugerida": categoria, "veces": veces},
+            "categoria_original": categoria_original,
+            "descripcion": descripcion,
+            "recomendacion": self._interpretar_resultado(categoria, categoria_original),
+            "confianza": round(min(0.99, proporcion), 4),
+            "origen": "memoria_usuario"
+        }
+    
+    def _respuesta_cache(self, descripcion: str, clave_cache: str) -> Optional[Dict[str, Any]]:
+        """Respuesta guardada en caché para la descripción, si existe"""
+        en_cache = self.cache.obtener(clave_cache)
+        if en_cache is None:
+            return None
+        return {**en_cache, "descripcion": descripcion, "origen": "cache"}
+    
+    def _respuesta_modelo(self, descripcion: str, categoria_original: str, clave_cache: str, result: Any) -> Dict[str, Any]:
+        """Construir (y guardar en caché) la respuesta a partir de la predicción remota"""
+        logger.info(f"Predicción exitosa para descripción: '{descripcion[:50]}...'")
+        
+        respuesta = {
+            "exito": True,
+            "prediccion_modelo": result,
+            "categoria_original": categoria_original,
+            "descripcion": descripcion,
+            "recomendacion": self._interpretar_resultado(result, categoria_original),
+            "confianza": self._calcular_confianza(result, categoria_original),
+            "origen": "modelo"
+        }
+        self.cache.guardar(clave_cache, respuesta)
+        return respuesta
+    
+    def _respuesta_sin_modelo(self, descripcion: str, categoria_original: str, prediccion_local: Optional[tuple], error: str = None) -> Dict[str, Any]:
+        """Respuesta cuando el modelo remoto no responde: clasificador local o fallback"""
+        if prediccion_local:
+            return self._respuesta_local(descripcion, categoria_original, *prediccion_local)
+        return self._respuesta_fallback(descripcion, categoria_original, error=error)
+    
+    def registrar_categoria_final(self, descripcion: str, categoria: str, usuario_id: Optional[int] = None):
+        """Aprender la categoría final elegida por el usuario (clasificador local y su historial)"""
+        try:
+            self.clasificador.entrenar(descripcion, categoria)
+            if usuario_id is not None:
+                self.memoria.registrar(usuario_id, descripcion, categoria)
+        except Exception as e:
+            logger.error(f"Error actualizando clasificador local: {str(e)}")
+    
+    def registrar_categorias_finales(self, ejemplos: Iterable[Tuple[str, str]], usuario_id: Optional[int] = None):
+        """
+        Como `registrar_categoria_final` para muchos gastos (p. ej. una importación):
+        cada par (descripción, categoría) repetido se aprende una sola vez con su número de repeticiones
+        """
+        for (descripcion, categoria), veces in Counter(ejemplos).items():
+            try:
+                self.clasificador.entrenar(descripcion, categoria, veces=veces)
+                if usuario_id is not None:
+                    self.memoria.registrar(usuario_id, descripcion, categoria, veces=veces)
+            except Exception as e:
+                logger.error(f"Error actualizando clasificador local: {str(e)}")
+    
+    def recordar_categoria(self, usuario_id: int, descripcion: str, categoria: str, fecha: Optional[datetime] = None):
+        """Añadir un gasto editado al historial del usuario"""
+        try:
+            self.memoria.registrar(usuario_id, descripcion, categoria, fecha)
+        except Exception as e:
+            logger.error(f"Error actualizando memoria de usuario: {str(e)}")
+    
+    def olvidar_categoria(self, usuario_id: int, descripcion: str, categoria: str):
+        """Quitar un gasto editado o eliminado del historial del usuario"""
+        try:
+            self.memoria.olvidar(usuario_id, descripcion, categoria)
+        except Exception as e:
+            logger.error(f"Error actualizando memoria de usuario: {str(e)}")
+    
+    def cargar_historial(self, db) -> int:
+        """Entrenar el clasificador local y la memoria por usuario con la tabla de gastos, en una sola pasada"""
+        from models import Gasto
+        
+        cargados = 0
+        consulta = db.query(Gasto.usuario_id, Gasto.descripcion, Gasto.categoria, Gasto.fecha).yield_per(1000)
+        for usuario_id, descripcion, categoria, fecha in consulta:
+            if not descripcion or not categoria:
+                continue
+            self.clasificador.entrenar(descripcion, categoria.value)
+            if usuario_id is not None:
+                self.memoria.registrar(usuario_id, descripcion, categoria.value, fecha)
+            cargados += 1
+        logger.info(f"Historial de ML cargado con {cargados} gastos")
+        return cargados
+    
+    def _respuesta_local(self, descripcion: str, categoria_original: str, categoria: str, probabilidad: float) -> Dict[str, Any]:
+        """Respuesta construida con la predicción del clasificador local"""
+        return {
+            "exito": True,
+            "prediccion_modelo": {"Categoría Sugerida": categoria, "probabilidad": round(probabilidad, 4)},
+            "categoria_original": categoria_original,
+            "descripcion": descripcion,
+            "recomendacion": self._interpretar_resultado(categoria, categoria_original),
+            "confianza": round(probabilidad, 4),
+            "origen": "local"
+        }
+    
+    def _clave_cache(self, descripcion: str, categoria_usuario: str) -> str:
+        """Clave de caché a partir de la descripción y categoría normalizadas"""
+        return f"{normalizar_texto(categoria_usuario)}|{normalizar_texto(descripcion)}"
     
     def _interpretar_resultado(self, resultado: Any, categoria_original: str) -> Dict[str, Any]:
         """
@@ -252,25 +583,10 @@ class MLService:
                 "coincide": True,
                 "mensaje": "🔧 Servicio de ML temporalmente no disponible. Se mantiene tu categoría elegida."
             },
-            "confianza": 1.0  # Alta confianza en la elección del usuario cuando ML no está disponible
+            "confianza": 1.0,  # Alta confianza en la elección del usuario cuando ML no está disponible
+            "origen": "fallback"
         }
     
-    def probar_conexion(self) -> Dict[str, Any]:
-        """Probar la conexión con el modelo"""
-        try:
-            resultado = self.obtener_sugerencia_categoria("test comida hamburguesa", "comida")
-            return {
-                "disponible": resultado["exito"],
-                "modelo": self.model_space,
-                "respuesta_test": resultado
-            }
-        except Exception as e:
-            return {
-                "disponible": False,
-                "modelo": self.model_space,
-                "error": str(e)
-            }
-
 # Instancia global del servicio
 ml_service = MLService()
 
@@ -278,24 +594,29 @@ ml_service = MLService()
 # Servicio para modelo Capibara
 # =============================
 
-class CapibaraService:
+class LoteDemasiadoGrande(Exception):
+    """El lote no se puede resolver con el modelo remoto: tiene demasiadas sesiones"""
+
+class CapibaraService(ServicioRemoto):
     """Servicio para interactuar con el modelo CapibaraModel en Hugging Face"""
-    def __init__(self):
-        self.client = None
-        self.model_space = "cristiandiaz2403/CapibaraModel"
-        self._initialize_client()
+    nombre = "Capibara"
+    tipo_backend = "capibara"
+    datos_sonda = {"bombs_hit": 0.0, "projectiles_hit": 0.0, "session_time": 60.0}
 
-    def _initialize_client(self):
-        try:
-            self.client = Client(self.model_space)
-            logger.info(f"Cliente Capibara inicializado correctamente para {self.model_space}")
-        except Exception as e:
-            logger.error(f"Error al inicializar cliente Capibara: {str(e)}")
-            self.client = None
+    def __init__(self):
+        super().__init__("cristiandiaz2403/CapibaraModel", backend=CAPIBARA_BACKEND, ruta_modelo=CAPIBARA_MODELO_PATH)
+        self.modelo_local = ModeloCapibaraLocal.cargar(CAPIBARA_MODELO_PATH)
+        self.cache = CacheLRU(
+            max_items=CAPIBARA_CACHE_MAX_ITEMS,
+            ttl=CAPIBARA_CACHE_TTL_SECONDS,
+            ruta_sqlite=ML_CACHE_SQLITE_PATH,
+            tabla="predicciones_capibara"
+        )
 
-    def predecir_dificultad(self, bombs_hit: float, projectiles_hit: float, session_time: float) -> dict:
+    async def predecir_dificultad_async(self, bombs_hit: float, projectiles_hit: float, session_time: float) -> dict:
         """
-        Realiza una predicción de dificultad usando el modelo CapibaraModel.
+        Realiza una predicción de dificultad usando el modelo CapibaraModel,
+        con concurrencia limitada y tiempo máximo por predicción.
         Args:
             bombs_hit: Bombas acertadas
             projectiles_hit: Proyectiles acertados
@@ -303,32 +624,101 @@ class CapibaraService:
         Returns:
             Diccionario con la predicción del modelo o error
         """
-        if not self.client:
-            logger.warning("Cliente Capibara no disponible, reintentar inicialización")
-            self._initialize_client()
-        if not self.client:
-            return self._respuesta_fallback(bombs_hit, projectiles_hit, session_time)
+        clave_cache = clave_sesion_capibara(bombs_hit, projectiles_hit, session_time)
+        en_cache = self._respuesta_cache(bombs_hit, projectiles_hit, session_time, clave_cache)
+        if en_cache is not None:
+            return en_cache
+        
         try:
-            result = self.client.predict(
+            result = await self._predecir_remoto_async(
                 bombs_hit=bombs_hit,
                 projectiles_hit=projectiles_hit,
-                session_time=session_time,
-                api_name="/predict"
+                session_time=session_time
             )
-            logger.info(f"Predicción Capibara exitosa: {result}")
-            return {
-                "exito": True,
-                "entrada": {
-                    "bombs_hit": bombs_hit,
-                    "projectiles_hit": projectiles_hit,
-                    "session_time": session_time
-                },
-                "resultado": result
-            }
+            self.cache.guardar(clave_cache, result)
+            return self._respuesta_exito(bombs_hit, projectiles_hit, session_time, result)
         except Exception as e:
-            logger.error(f"Error en predicción Capibara: {str(e)}")
+            logger.error(f"Error en predicción Capibara asíncrona: {str(e)}")
             return self._respuesta_fallback(bombs_hit, projectiles_hit, session_time, error=str(e))
 
+    async def predecir_lote_async(self, sesiones: List[Tuple[float, float, float]], validar: int = 0) -> Dict[str, Any]:
+        """
+        Predecir la dificultad de muchas sesiones en una sola llamada, en el mismo orden.
+
+        Con modelo local cargado, todas las sesiones se resuelven en una operación
+        vectorizada y, si `validar` > 0, las primeras `validar` sesiones se comparan
+        con el modelo remoto. Sin modelo local se consulta el remoto por sesión, como mucho
+        ML_LOTE_CONCURRENCIA a la vez; los lotes de más de LOTE_MAX_ELEMENTOS
+        sesiones se rechazan con LoteDemasiadoGrande.
+        """
+        if self.modelo_local is None:
+            if len(sesiones) > LOTE_MAX_ELEMENTOS:
+                raise LoteDemasiadoGrande(
+                    f"Sin modelo local solo se pueden predecir {LOTE_MAX_ELEMENTOS} sesiones por lote"
+                )
+            predicciones = await self._predecir_remotas(sesiones)
+            return {"total": len(sesiones), "modelo_local": False, "predicciones": predicciones}
+
+        resultados = self.modelo_local.predecir_lote(sesiones)
+        predicciones = [
+            self._respuesta_exito(*sesion, resultado, origen="local", registrar=False)
+            for sesion, resultado in zip(sesiones, resultados)
+        ]
+        respuesta = {"total": len(sesiones), "modelo_local": True, "predicciones": predicciones}
+
+        if validar > 0:
+            muestra = sesiones[:validar]
+            remotas = await self._predecir_remotas(muestra)
+            comparables = [
+                (local, remota["resultado"]) for local, remota in zip(resultados, remotas) if remota["exito"]
+            ]
+            coincidencias = sum(1 for local, remota in comparables if self._coinciden(local, remota))
+            respuesta["validacion"] = {
+                "muestra": len(muestra),
+                "comparadas": len(comparables),
+                "coincidencias": coincidencias,
+                "tasa_coincidencia": round(coincidencias / len(comparables), 4) if comparables else None
+            }
+        return respuesta
+
+    async def _predecir_remotas(self, sesiones: List[Tuple[float, float, float]]) -> List[dict]:
+        resultados = await self._en_paralelo([
+            lambda sesion=sesion: self.predecir_dificultad_async(*sesion) for sesion in sesiones
+        ])
+        return [
+            self._respuesta_fallback(*sesion, error=str(resultado)) if isinstance(resultado, Exception) else resultado
+            for sesion, resultado in zip(sesiones, resultados)
+        ]
+
+    @staticmethod
+    def _coinciden(local: Any, remota: Any) -> bool:
+        """Comparar la predicción local con la remota (numérica con tolerancia, o por etiqueta)"""
+        try:
+            return math.isclose(float(local), float(remota), rel_tol=0.05, abs_tol=1e-6)
+        except (TypeError, ValueError):
+            return str(local).strip().lower() == str(remota).strip().lower()
+
+    def _respuesta_cache(self, bombs_hit, projectiles_hit, session_time, clave_cache):
+        """Predicción guardada para la cubeta de la sesión, si existe"""
+        result = self.cache.obtener(clave_cache)
+        if result is None:
+            return None
+        return self._respuesta_exito(bombs_hit, projectiles_hit, session_time, result, origen="cache", registrar=False)
+
+    def _respuesta_exito(self, bombs_hit, projectiles_hit, session_time, result, origen="modelo", registrar=True):
+        if registrar:
+            logger.info(f"Predicción Capibara exitosa: {result}")
+        return {
+            "exito": True,
+            "entrada": {
+                "bombs_hit": bombs_hit,
+                "projectiles_hit": projectiles_hit,
+                "session_time": session_time
+            },
+            "resultado": result,
+            "origen": origen
+        }
+
     def _respuesta_fallback(self, bombs_hit, projectiles_hit, session_time, error=None):
         return {
             "exito": False,
@@ -338,8 +728,12 @@ class CapibaraService:
                 "projectiles_hit": projectiles_hit,
                 "session_time": session_time
             },
-            "resultado": None
+            "resultado": None,
+            "origen": "fallback"
         }
 
 # Instancia global del servicio Capibara
 capibara_service = CapibaraService()
+
+# Monitor de salud de ambos modelos (se inicia con la aplicación)
+monitor_salud = MonitorSalud([ml_service, capibara_service])
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Enum, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -23,6 +23,8 @@ class Usuario(Base):
     telefono = Column(String, nullable=True)  # Opcional
     presupuesto = Column(Float, nullable=True, default=None)  # Opcional
     periodo_presupuesto = Column(Enum(PeriodoPresupuesto), nullable=True, default=None)  # Opcional
+    gasto_periodo = Column(Float, nullable=False, default=0.0)  # Gastado en el periodo que empieza en inicio_periodo
+    inicio_periodo = Column(Date, nullable=True)                 # Ver presupuesto.py
     
     # Campos de autenticación
     password_hash = Column(String, nullable=False)  # Contraseña hasheada
@@ -38,16 +40,46 @@ class Usuario(Base):
 class Gasto(Base):
     __tablename__ = "gastos"
     
-    id = Column(Integer, primary_key=True, index=True)
-    usuario_id = Column(Integer, ForeignKey("usuarios.id"), index=True)
-    descripcion = Column(String, index=True)
-    monto = Column(Float, index=True)
-    categoria = Column(Enum(CategoriaGasto), index=True)
-    fecha = Column(DateTime, default=datetime.utcnow, index=True)
+    id = Column(Integer, primary_key=True)  # La clave primaria ya es un índice
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"))
+    descripcion = Column(String)
+    monto = Column(Float)
+    categoria = Column(Enum(CategoriaGasto))
+    fecha = Column(DateTime, default=datetime.utcnow)
     
     # Campos de auditoría
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relaciones
-    usuario = relationship("Usuario", back_populates="gastos")
\ No newline at end of file
+    usuario = relationship("Usuario", back_populates="gastos")
+    
+    # Índices según las consultas reales: los gastos de un usuario, opcionalmente por categoría,
+    # ordenados por fecha descendente; el id desempata y permite paginar por cursor (ver migraciones.py)
+    __table_args__ = (
+        Index("ix_gastos_usuario_fecha_id", usuario_id, fecha.desc(), id.desc()),
+        Index("ix_gastos_usuario_categoria_fecha_id", usuario_id, categoria, fecha.desc(), id.desc()),
+    )
+
+class ResumenGasto(Base):
+    __tablename__ = "resumen_gastos"
+    
+    # Totales por usuario, periodo (día, semana o mes que empieza en `inicio`) y categoría,
+    # actualizados en la misma transacción que cada gasto (ver resumenes.py)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True)
+    periodo = Column(Enum(PeriodoPresupuesto), primary_key=True)
+    inicio = Column(Date, primary_key=True)
+    categoria = Column(Enum(CategoriaGasto), primary_key=True)
+    cantidad = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0.0)
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    
+    # Solo se guarda el HMAC del token, nunca el token en claro
+    token_hash = Column(String(64), primary_key=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), index=True, nullable=False)
+    familia = Column(String(32), index=True, nullable=False)  # Cadena de rotaciones desde un mismo login
+    usado = Column(Boolean, default=False, nullable=False)    # Ya rotado: volver a usarlo indica robo
+    expira = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
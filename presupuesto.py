@@ -0,0 +1,94 @@
+"""
+Estado del presupuesto del usuario (Usuario.presupuesto por periodo_presupuesto).
+
+`Usuario.gasto_periodo` acumula lo gastado en el periodo que empieza en
+`Usuario.inicio_periodo`. Cada gasto creado, editado o eliminado lo ajusta con un
+único UPDATE ... RETURNING, que además lo pone a cero al cambiar de periodo, así el
+estado se obtiene sin sumar los gastos del periodo.
+"""
+from datetime import date, datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import Date, case, func, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import PeriodoPresupuesto, ResumenGasto, Usuario
+from resumenes import inicio_periodo
+
+
+def _por_periodo(valores: dict, tipo=None, sin_periodo=None):
+    """CASE sobre el periodo del usuario con un valor para cada tipo de periodo"""
+    return case(
+        *[(Usuario.periodo_presupuesto == periodo, literal(valor, tipo)) for periodo, valor in valores.items()],
+        else_=sin_periodo
+    )
+
+
+async def ajustar_gasto_periodo(db: AsyncSession, usuario_id: int, movimientos: Iterable[Tuple[datetime, float]],
+                                ahora: Optional[datetime] = None) -> Optional[dict]:
+    """
+    Sumar a lo gastado en el periodo actual los movimientos (fecha, importe) cuya fecha
+    cae en él, dentro de la transacción de la sesión. Devuelve el estado del presupuesto tras el cambio.
+    """
+    ahora = ahora or datetime.now()
+    actuales = {periodo: inicio_periodo(ahora, periodo) for periodo in PeriodoPresupuesto}
+    # Un gasto solo cuenta si es del periodo actual del tipo que use el usuario
+    deltas = dict.fromkeys(actuales, 0.0)
+    for fecha, delta in movimientos:
+        for periodo, inicio in actuales.items():
+            if inicio_periodo(fecha, periodo) == inicio:
+                deltas[periodo] += delta
+    inicio_actual = _por_periodo(actuales, Date)
+    delta_usuario = _por_periodo(deltas, sin_periodo=0.0)
+
+    resultado = await db.execute(
+        update(Usuario)
+        .where(Usuario.id == usuario_id)
+        .values(
+            # Periodo nuevo: lo acumulado era del anterior y se descarta
+            gasto_periodo=case(
+                (Usuario.inicio_periodo == inicio_actual, func.coalesce(Usuario.gasto_periodo, 0.0) + delta_usuario),
+                else_=delta_usuario
+            ),
+            inicio_periodo=inicio_actual,
+            updated_at=Usuario.updated_at  # No es un cambio del perfil
+        )
+        .returning(Usuario.presupuesto, Usuario.periodo_presupuesto, Usuario.inicio_periodo, Usuario.gasto_periodo)
+        .execution_options(synchronize_session=False)
+    )
+    fila = resultado.first()
+    return estado_presupuesto(*fila, ahora=ahora) if fila else None
+
+
+async def recalcular_gasto_periodo(db: AsyncSession, usuario: Usuario, ahora: Optional[datetime] = None):
+    """Reiniciar el contador desde el resumen de gastos (p. ej. al cambiar de tipo de periodo)"""
+    if usuario.periodo_presupuesto is None:
+        usuario.inicio_periodo, usuario.gasto_periodo = None, 0.0
+        return
+    inicio = inicio_periodo(ahora or datetime.now(), usuario.periodo_presupuesto)
+    total = await db.scalar(
+        select(func.coalesce(func.sum(ResumenGasto.total), 0.0)).where(
+            ResumenGasto.usuario_id == usuario.id,
+            ResumenGasto.periodo == usuario.periodo_presupuesto,
+            ResumenGasto.inicio == inicio
+        )
+    )
+    usuario.inicio_periodo, usuario.gasto_periodo = inicio, round(total, 2)
+
+
+def estado_presupuesto(presupuesto: Optional[float], periodo: Optional[PeriodoPresupuesto],
+                       inicio: Optional[date], gastado: Optional[float],
+                       ahora: Optional[datetime] = None) -> dict:
+    """Estado a partir de las columnas del usuario; un contador de un periodo pasado vale cero"""
+    inicio_actual = inicio_periodo(ahora or datetime.now(), periodo) if periodo else None
+    gastado = round(gastado or 0.0, 2) if inicio is not None and inicio == inicio_actual else 0.0
+    restante = round(presupuesto - gastado, 2) if presupuesto is not None else None
+    return {
+        "presupuesto": presupuesto,
+        "periodo_presupuesto": periodo,
+        "inicio": inicio_actual,
+        "gastado": gastado,
+        "restante": restante,
+        "porcentaje_usado": round(gastado / presupuesto * 100, 1) if presupuesto else None,
+        "excedido": restante is not None and restante < 0
+    }
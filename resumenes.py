@@ -0,0 +1,168 @@
+"""
+Resúmenes de gastos por usuario, categoría y periodo (día, semana y mes).
+
+La tabla `resumen_gastos` se actualiza en la misma transacción que cada gasto
+creado, editado o eliminado, así el resumen se lee sin recorrer los gastos.
+Para recalcularla desde cero (p. ej. tras importar datos a mano):
+
+    python resumenes.py [--usuario ID]
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import CategoriaGasto, Gasto, PeriodoPresupuesto, ResumenGasto
+
+logger = logging.getLogger(__name__)
+
+# (usuario_id, categoría, fecha, cantidad, total): un gasto suma (1, monto) y resta (-1, -monto)
+Movimiento = Tuple[int, CategoriaGasto, datetime, int, float]
+
+_CLAVE = ["usuario_id", "periodo", "inicio", "categoria"]
+
+
+def inicio_periodo(fecha: datetime, periodo: PeriodoPresupuesto) -> date:
+    """Primer día del periodo que contiene la fecha (las semanas empiezan en lunes)"""
+    dia = fecha.date() if isinstance(fecha, datetime) else fecha
+    if periodo == PeriodoPresupuesto.SEMANAL:
+        return dia - timedelta(days=dia.weekday())
+    if periodo == PeriodoPresupuesto.MENSUAL:
+        return dia.replace(day=1)
+    return dia
+
+
+def periodo_anterior(inicio: date, periodo: PeriodoPresupuesto) -> date:
+    if periodo == PeriodoPresupuesto.SEMANAL:
+        return inicio - timedelta(days=7)
+    if periodo == PeriodoPresupuesto.MENSUAL:
+        return (inicio - timedelta(days=1)).replace(day=1)
+    return inicio - timedelta(days=1)
+
+
+def _acumular(movimientos: Iterable[Movimiento]) -> Dict[tuple, list]:
+    """Sumar los movimientos por fila del resumen (una por periodo y gasto)"""
+    filas: Dict[tuple, list] = defaultdict(lambda: [0, 0.0])
+    for usuario_id, categoria, fecha, cantidad, total in movimientos:
+        if categoria is None or fecha is None:
+            continue
+        for periodo in PeriodoPresupuesto:
+            fila = filas[(usuario_id, periodo, inicio_periodo(fecha, periodo), categoria)]
+            fila[0] += cantidad
+            fila[1] += total
+    return filas
+
+
+def _upsert(dialecto: str, sumar: bool = True):
+    """
+    INSERT ... ON CONFLICT para ejecutar con varias filas: con `sumar` se añaden
+    a los totales existentes; si no, los sustituyen
+    """
+    insertar = postgresql.insert if dialecto == "postgresql" else sqlite.insert
+    stmt = insertar(ResumenGasto.__table__)
+    tabla = ResumenGasto.__table__.c
+    return stmt.on_conflict_do_update(
+        index_elements=_CLAVE,
+        set_={
+            "cantidad": tabla.cantidad + stmt.excluded.cantidad if sumar else stmt.excluded.cantidad,
+            "total": tabla.total + stmt.excluded.total if sumar else stmt.excluded.total,
+        }
+    )
+
+
+def _parametros(filas: Dict[tuple, list]) -> List[dict]:
+    return [dict(zip(_CLAVE, clave), cantidad=cantidad, total=total) for clave, (cantidad, total) in filas.items()]
+
+
+async def ajustar_resumen(db: AsyncSession, movimientos: Iterable[Movimiento]):
+    """
+    Aplicar los movimientos al resumen dentro de la transacción de la sesión:
+    se confirman o se descartan junto con el cambio del gasto
+    """
+    filas = {clave: valores for clave, valores in _acumular(movimientos).items() if valores != [0, 0.0]}
+    if filas:
+        await db.execute(_upsert(db.bind.dialect.name), _parametros(filas))
+
+
+async def consultar_resumen(db: AsyncSession, usuario_id: int, periodo: PeriodoPresupuesto,
+                            fecha: datetime, periodos: int = 1) -> List[dict]:
+    """
+    Totales por categoría de los `periodos` últimos periodos hasta el que contiene `fecha`,
+    del más reciente al más antiguo. Lee como mucho periodos × categorías filas.
+    """
+    inicios = [inicio_periodo(fecha, periodo)]
+    for _ in range(periodos - 1):
+        inicios.append(periodo_anterior(inicios[-1], periodo))
+
+    filas = await db.execute(
+        select(ResumenGasto.inicio, ResumenGasto.categoria, ResumenGasto.cantidad, ResumenGasto.total)
+        .where(
+            ResumenGasto.usuario_id == usuario_id,
+            ResumenGasto.periodo == periodo,
+            ResumenGasto.inicio >= inicios[-1],
+            ResumenGasto.inicio <= inicios[0]
+        )
+    )
+    por_periodo: Dict[date, Dict[CategoriaGasto, tuple]] = defaultdict(dict)
+    for inicio, categoria, cantidad, total in filas:
+        por_periodo[inicio][categoria] = (cantidad, total)
+
+    resumen = []
+    for inicio in inicios:
+        categorias = [
+            {
+                "categoria": categoria,
+                "cantidad": por_periodo[inicio].get(categoria, (0, 0.0))[0],
+                "total": round(por_periodo[inicio].get(categoria, (0, 0.0))[1], 2)
+            }
+            for categoria in CategoriaGasto
+        ]
+        resumen.append({
+            "inicio": inicio,
+            "cantidad": sum(c["cantidad"] for c in categorias),
+            "total": round(sum(c["total"] for c in categorias), 2),
+            "categorias": categorias
+        })
+    return resumen
+
+
+def reconstruir_resumenes(conexion: Connection, usuario_id: Optional[int] = None, lote: int = 1000) -> int:
+    """
+    Recalcular el resumen desde la tabla de gastos (de todos los usuarios o de uno).
+    Conviene ejecutarlo sin escrituras en curso, p. ej. durante el despliegue.
+    Devuelve el número de filas del resumen.
+    """
+    borrar = delete(ResumenGasto)
+    consulta = select(Gasto.usuario_id, Gasto.categoria, Gasto.fecha, Gasto.monto).where(Gasto.usuario_id.is_not(None))
+    if usuario_id is not None:
+        borrar = borrar.where(ResumenGasto.usuario_id == usuario_id)
+        consulta = consulta.where(Gasto.usuario_id == usuario_id)
+    conexion.execute(borrar)
+
+    gastos = conexion.execution_options(yield_per=lote).execute(consulta)
+    filas = _acumular((uid, categoria, fecha, 1, monto or 0.0) for uid, categoria, fecha, monto in gastos)
+    parametros = _parametros(filas)
+    for i in range(0, len(parametros), lote):
+        conexion.execute(_upsert(conexion.dialect.name, sumar=False), parametros[i:i + lote])
+    logger.info(f"Resumen de gastos reconstruido: {len(parametros)} filas")
+    return len(parametros)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Reconstruir la tabla resumen_gastos desde los gastos")
+    parser.add_argument("--usuario", type=int, help="Solo este usuario")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with engine.begin() as conexion:
+        total = reconstruir_resumenes(conexion, args.usuario)
+    print(f"✅ Resumen reconstruido: {total} filas")
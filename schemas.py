@@ -1,10 +1,15 @@
 from pydantic import BaseModel, validator
 from typing import Optional, List, Any
-from datetime import datetime
+from datetime import date, datetime
 from models import CategoriaGasto, PeriodoPresupuesto
 import enum
+import os
 import re
 
+# Elementos por petición en los endpoints por lotes que consultan o modifican uno a uno
+# (verificación de categorías, eliminación de gastos, predicciones con el modelo remoto)
+LOTE_MAX_ELEMENTOS = int(os.getenv("LOTE_MAX_ELEMENTOS", "100"))
+
 # Esquemas base
 class UsuarioBase(BaseModel):
     nombre: str
@@ -79,14 +84,19 @@ class Token(BaseModel):
     token_type: str
     user_id: int
     expires_in: int
+    refresh_token: Optional[str] = None
 
 class TokenWithUser(BaseModel):
     access_token: str
     token_type: str
     user_id: int
     expires_in: int
+    refresh_token: Optional[str] = None
     user: UsuarioResponse
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 class TokenData(BaseModel):
     email: Optional[str] = None
     
@@ -123,6 +133,34 @@ class Gasto(GastoBase):
     class Config:
         from_attributes = True
 
+class GastoCreado(Gasto):
+    presupuesto_restante: Optional[float] = None  # None si el usuario no tiene presupuesto
+    gastado_periodo: Optional[float] = None
+
+class EstadoPresupuesto(BaseModel):
+    presupuesto: Optional[float] = None
+    periodo_presupuesto: Optional[PeriodoPresupuesto] = None
+    inicio: Optional[date] = None  # Primer día del periodo actual
+    gastado: float
+    restante: Optional[float] = None
+    porcentaje_usado: Optional[float] = None
+    excedido: bool
+
+class PaginaGastos(BaseModel):
+    gastos: List[Gasto]
+    next_cursor: Optional[str] = None  # Cursor de la página siguiente; None en la última
+
+class ResumenCategoria(BaseModel):
+    categoria: CategoriaGasto
+    cantidad: int
+    total: float
+
+class ResumenPeriodo(BaseModel):
+    inicio: date  # Primer día del periodo
+    cantidad: int
+    total: float
+    categorias: List[ResumenCategoria]
+
 # Esquemas para eliminación de gastos
 class EliminacionGastoRequest(BaseModel):
     gastos_ids: List[int]
@@ -132,8 +170,8 @@ class EliminacionGastoRequest(BaseModel):
     def validar_lista_ids(cls, v):
         if not v:
             raise ValueError('Debe proporcionar al menos un ID de gasto')
-        if len(v) > 100:
-            raise ValueError('No se pueden eliminar más de 100 gastos a la vez')
+        if len(v) > LOTE_MAX_ELEMENTOS:
+            raise ValueError(f'No se pueden eliminar más de {LOTE_MAX_ELEMENTOS} gastos a la vez')
         return v
 
 class GastoEliminado(BaseModel):
@@ -197,6 +235,7 @@ class SugerenciaResponse(BaseModel):
     recomendacion: RecomendacionCategoria
     confianza: float
     error: Optional[str] = None
+    origen: Optional[str] = None  # "memoria_usuario", "modelo", "cache", "local" o "fallback"
 
 # Esquemas para decisión del usuario
 class GastoConDecision(BaseModel):
@@ -221,6 +260,18 @@ class GastoConDecision(BaseModel):
             raise ValueError('La descripción debe tener al menos 3 caracteres')
         return v.strip()
 
+class ErrorFilaImportacion(BaseModel):
+    linea: int  # Línea del archivo (la cabecera del CSV es la 1)
+    error: str
+
+class ResultadoImportacion(BaseModel):
+    procesadas: int
+    importados: int
+    categorizados_ml: int
+    total_errores: int
+    errores: List[ErrorFilaImportacion]  # Solo los primeros IMPORTACION_MAX_ERRORES
+    presupuesto_restante: Optional[float] = None
+
 class FeedbackML(BaseModel):
     categoria_original: str
     categoria_sugerida: Optional[str] = None